@@ -0,0 +1,391 @@
+"""Benchmarks for the label rendering and tiling hot paths.
+
+Each case runs in a fresh process, so the peak RSS it reports is its own. Results are written as JSON and compared
+against a stored baseline: a case whose throughput drops, or whose peak memory grows, by more than --tolerance is a
+regression, and the exit status is non-zero.
+
+    python bench.py                      # run everything, compare with bench_baseline.json
+    python bench.py --update-baseline    # run everything and store the results as the new baseline
+    python bench.py --stages startup     # just check that importing label stays within --startup-budget
+    python bench.py --stages compositor  # just check that the NumPy compositor matches Pillow pixel for pixel
+    python bench.py --stages bands       # just check that --bands pages match whole ones, template included
+
+Run from the repo root, like label.py.
+"""
+import click
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import PIL
+from PIL import Image
+
+import label
+from label import Item, Profile
+
+SIZES = "100,10000,100000"
+DPIS = "150,300,900"
+ROWS_PER_CSV = 1000
+STARTUP_RUNS = 10  # Best of, so the startup budget checks import work rather than scheduling noise
+STARTUP_BUDGET = 0.1  # Seconds to import label, see bench_startup
+ASSET_PHOTOS = 16  # Synthetic photos thumbnailed by bench_assets, half JPEG and half PNG
+ASSET_PHOTO_SIZE = (3000, 2000)
+PARITY_PASTES = 300  # Random pastes per color mode in bench_compositor
+PARITY_PAGE = (160, 120)
+
+GAUGES = ["#4", "#6", "#8", "#10", "#12", "1/4", "5/16", "M3", "M4", "M5", "16", "18"]
+LENGTHS = ["1/2\"", "5/8\"", "3/4\"", "1\"", "1-1/4\"", "1-1/2\"", "2\"", "3\"", ""]
+STYLES = ["", "zinc", "stainless", "black oxide"]
+
+
+def synthetic_items(n: int, seed: int = 0):
+    """n random Items whose category and subcat name a real img/subcat asset."""
+    rng = random.Random(seed)
+    names = sorted(k.split("_", 1) for k in label.SUBCAT_IMS if "_" in k)
+    return [
+        Item(
+            category=category,
+            subcat=subcat,
+            style=rng.choice(STYLES),
+            gauge=rng.choice(GAUGES),
+            length=rng.choice(LENGTHS),
+            notes="",
+        )
+        for category, subcat in (rng.choice(names) for _ in range(n))
+    ]
+
+
+def write_inventory(items: list, path: str):
+    """Write items as a directory of CSVs, ROWS_PER_CSV rows each, the way load_items expects them."""
+    os.makedirs(path, exist_ok=True)
+    for start in range(0, len(items), ROWS_PER_CSV):
+        with open(os.path.join(path, "inventory-{:04}.csv".format(start // ROWS_PER_CSV)), "w", newline="") as fout:
+            writer = csv.writer(fout)
+            writer.writerow(Item._fields)
+            writer.writerows(items[start : start + ROWS_PER_CSV])
+
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def bench_load_items(n, dpi, tmp, max_labels, max_pages):
+    path = os.path.join(tmp, "inventory")
+    write_inventory(synthetic_items(n), path)
+    return n, "items/s", _timed(label.load_items, path)
+
+
+def bench_make_label(n, dpi, tmp, max_labels, max_pages):
+    profile = Profile(dpi=dpi)
+    items = [label.pretty_item(i) for i in synthetic_items(max_labels)]
+    start = time.perf_counter()
+    for i, item in enumerate(items):
+        label.make_label(item, os.path.join(tmp, "{}.png".format(i)), profile=profile)
+    return len(items), "labels/s", time.perf_counter() - start
+
+
+def _simple_squares(count, profile):
+    names = sorted(label.SUBCAT_IMS)
+    return [
+        label.make_simple_square(
+            label.SUBCAT_IMS[name],
+            name,
+            thumbsize=profile.simple_thumbsize,
+            labelsize=profile.simple_labelsize,
+            font=profile.font_sub,
+            profile=profile,
+        )
+        for name in (names[i % len(names)] for i in range(count))
+    ]
+
+
+def bench_make_simple_square(n, dpi, tmp, max_labels, max_pages):
+    profile = Profile(dpi=dpi)
+    return max_labels, "labels/s", _timed(_simple_squares, max_labels, profile)
+
+
+def bench_template_tile(n, dpi, tmp, max_labels, max_pages):
+    profile = Profile(dpi=dpi)
+    ims = _simple_squares(max_labels, profile)
+    start = time.perf_counter()
+    for _ in range(max_pages):
+        label.template_tile(ims, cell_size=profile.cellsize, profile=profile)
+    return max_pages, "pages/s", time.perf_counter() - start
+
+
+def bench_tile(n, dpi, tmp, max_labels, max_pages):
+    """Tile (and encode) up to max_pages pages of an n item inventory, with its distinct labels pre-rendered."""
+    profile = Profile(dpi=dpi)
+    l_per_row, l_per_col = label._tile_grid(profile.papersize, profile.labelsize, profile.margin)
+    per_page = int(l_per_row * l_per_col)
+    items = synthetic_items(n)[: per_page * max_pages]
+    unique, order = label.dedupe_items(items)
+    rendered = [
+        label.make_label(item, os.path.join(tmp, "{}.png".format(i)), profile=profile) for i, item in enumerate(unique)
+    ]
+    labels = list(label.place_labels(rendered, order))
+    out_label = os.path.join(tmp, "all")
+    seconds = _timed(label.tile, labels, profile.papersize, profile.labelsize, out_label, profile=profile)
+    return -(-len(labels) // per_page), "pages/s", seconds
+
+
+def _random_label(rng: random.Random, mode: str):
+    """A noisy label, opaque or clear with maybe a translucent patch, converted to mode like a thumbnail."""
+    w, h = rng.randint(1, 60), rng.randint(1, 60)
+    im = Image.frombytes("RGB", (w, h), rng.getrandbits(8 * w * h * 3).to_bytes(w * h * 3, "little"))
+    alpha = Image.new("L", (w, h), rng.choice((0, 255)))
+    if rng.random() < 0.7:
+        pw, ph = rng.randint(1, w), rng.randint(1, h)
+        patch = Image.frombytes("L", (pw, ph), rng.getrandbits(8 * pw * ph).to_bytes(pw * ph, "little"))
+        alpha.paste(patch, (rng.randint(0, w - pw), rng.randint(0, h - ph)))
+    im.putalpha(alpha)
+    return label._to_mode(im, mode)
+
+
+def _composite(compositor: str, mode: str, seed: int):
+    """PARITY_PASTES random pastes, many clipped by the page edge and some grouped on a scratch page first."""
+    rng = random.Random(seed)
+    labels = [_random_label(rng, mode) for _ in range(12)]  # Reused, as each label is analysed once per page
+    page = label._new_page(PARITY_PAGE, mode=mode, compositor=compositor)
+
+    def place(im, size):
+        return rng.randint(-im.size[0], size[0]), rng.randint(-im.size[1], size[1])
+
+    for _ in range(PARITY_PASTES):
+        if rng.random() < 0.1:
+            size = (rng.randint(20, 80), rng.randint(20, 80))
+            group = page.scratch(size)
+            for im in rng.sample(labels, 3):
+                group.paste_ink(im, place(im, size))
+            page.paste_ink(group, (rng.randint(-size[0], PARITY_PAGE[0]), rng.randint(-size[1], PARITY_PAGE[1])))
+        else:
+            im = rng.choice(labels)
+            page.paste_ink(im, place(im, PARITY_PAGE))
+    return page.image()
+
+
+def bench_compositor(n, dpi, tmp, max_labels, max_pages):
+    """Time the NumPy compositor on random pastes in every color mode, checking it matches Pillow pixel for pixel."""
+    if not label._import_numpy():
+        return 0, "pastes/s", 0
+    seconds = 0
+    for seed, mode in enumerate(label.COLOR_MODES.values()):
+        start = time.perf_counter()
+        got = _composite("numpy", mode, seed)
+        seconds += time.perf_counter() - start
+        want = _composite("pillow", mode, seed)
+        if (got.mode, got.getpalette(), got.tobytes()) != (want.mode, want.getpalette(), want.tobytes()):
+            raise AssertionError("The numpy compositor differs from pillow in {} mode (seed {})".format(mode, seed))
+    return PARITY_PASTES * len(label.COLOR_MODES), "pastes/s", seconds
+
+
+def bench_bands(n, dpi, tmp, max_labels, max_pages):
+    """Tile max_pages template pages as --bands does, from a lazy stream of labels, checking every page matches the
+    unbanded render pixel for pixel.
+
+    """
+    profile = Profile(dpi=dpi)
+    l_per_row, l_per_col = label._tile_grid(profile.papersize, profile.labelsize, profile.margin)
+    items = synthetic_items(int(l_per_row * l_per_col) * max_pages)
+    unique, order = label.dedupe_items(items)
+    rendered = [
+        label.make_label(item, os.path.join(tmp, "{}.png".format(i)), profile=profile) for i, item in enumerate(unique)
+    ]
+    labels = list(label.place_labels(rendered, order))
+    underlay = Image.open("label_sheet_template.png").convert("RGBA")
+    whole, banded = os.path.join(tmp, "whole"), os.path.join(tmp, "banded")
+    label.tile(labels, profile.papersize, profile.labelsize, whole, underlay=underlay, profile=profile)
+    writer = label.ImageWriter(workers=1, max_pending=1, band_rows=label.BAND_ROWS)
+    start = time.perf_counter()
+    label.tile(
+        iter(labels), profile.papersize, profile.labelsize, banded, underlay=underlay, writer=writer, profile=profile
+    )
+    writer.close()
+    seconds = time.perf_counter() - start
+    pages = sorted(f[len("whole") :] for f in os.listdir(tmp) if f.startswith("whole_page"))
+    if pages != sorted(f[len("banded") :] for f in os.listdir(tmp) if f.startswith("banded_page")):
+        raise AssertionError("Banded tiling wrote different pages at {} DPI".format(dpi))
+    for page in pages:
+        if Image.open(whole + page).tobytes() != Image.open(banded + page).tobytes():
+            raise AssertionError("Banded page{} differs from the unbanded one at {} DPI".format(page, dpi))
+    return len(pages), "pages/s", seconds
+
+
+def _write_photos(path: str, count: int):
+    """Write count noisy ASSET_PHOTO_SIZE images to path, alternately JPEG and PNG, like a folder of photos."""
+    os.makedirs(path)
+    noise = Image.effect_noise((ASSET_PHOTO_SIZE[0] // 8, ASSET_PHOTO_SIZE[1] // 8), 64).convert("RGB")
+    photo = noise.resize(ASSET_PHOTO_SIZE, Image.BICUBIC)
+    for i in range(count):
+        photo.save(os.path.join(path, "photo_{}.{}".format(i, "jpg" if i % 2 else "png")))
+
+
+def bench_assets(n, dpi, tmp, max_labels, max_pages):
+    """Decode a folder of large photos and thumbnail them to part label size, as for a new asset library."""
+    profile = Profile(dpi=dpi)
+    path = os.path.join(tmp, "photos")
+    _write_photos(path, ASSET_PHOTOS)
+    registry = label.load_img_folder(path)
+    thumbs = label.ThumbnailCache()
+    start = time.perf_counter()
+    label.preload_assets(lambda fname: thumbs.get(registry, fname, profile.thumbsize), registry)
+    return len(registry), "images/s", time.perf_counter() - start
+
+
+def _fresh_python(code: str):
+    """Run code in a new interpreter and return what it prints, as a float."""
+    return float(subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout)
+
+
+def bench_startup(n, dpi, tmp, max_labels, max_pages):
+    """Best of STARTUP_RUNS times to `import label` in a fresh interpreter, which every CLI run and tool pays."""
+    code = "import time; start = time.perf_counter(); import label; print(time.perf_counter() - start)"
+    return 1, "imports/s", min(_fresh_python(code) for _ in range(STARTUP_RUNS))
+
+
+def bench_help(n, dpi, tmp, max_labels, max_pages):
+    """Best of STARTUP_RUNS wall times for `label.py --help`, interpreter startup included."""
+    code = (
+        "import subprocess, sys, time; start = time.perf_counter(); "
+        "subprocess.run([sys.executable, 'label.py', '--help'], check=True, capture_output=True); "
+        "print(time.perf_counter() - start)"
+    )
+    return 1, "runs/s", min(_fresh_python(code) for _ in range(STARTUP_RUNS))
+
+
+# stage: (bench function, varies with inventory size, varies with DPI)
+STAGES = {
+    "startup": (bench_startup, False, False),
+    "help": (bench_help, False, False),
+    "load_items": (bench_load_items, True, False),
+    "assets": (bench_assets, False, True),
+    "make_label": (bench_make_label, False, True),
+    "make_simple_square": (bench_make_simple_square, False, True),
+    "template_tile": (bench_template_tile, False, True),
+    "tile": (bench_tile, True, True),
+    "bands": (bench_bands, False, True),
+    "compositor": (bench_compositor, False, False),
+}
+
+
+def run_case(stage, n, dpi, max_labels, max_pages):
+    """Run one benchmark in this (fresh) process and return its record."""
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        count, unit, seconds = STAGES[stage][0](n, dpi, tmp, max_labels, max_pages)
+    return {
+        "count": count,
+        "unit": unit,
+        "seconds": round(seconds, 4),
+        "rate": round(count / seconds, 3) if seconds else None,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def case_key(stage, n, dpi):
+    params = ([] if n is None else ["n={}".format(n)]) + ([] if dpi is None else ["dpi={}".format(dpi)])
+    return "{}[{}]".format(stage, ",".join(params))
+
+
+def compare(results: dict, baseline: dict, tolerance: float):
+    """Print results next to the baseline.
+
+    Returns:
+        list[str]: keys of cases that regressed by more than tolerance
+
+    """
+    regressions = []
+    print("{:<36} {:>18} {:>8} {:>9} {:>9}".format("case", "rate", "RSS MB", "rate Δ", "RSS Δ"))
+    for key, cur in results.items():
+        base = baseline.get(key)
+        rate_d = rss_d = ""
+        if base and base["rate"] and cur["rate"]:
+            rate_ratio, rss_ratio = cur["rate"] / base["rate"], cur["peak_rss_mb"] / base["peak_rss_mb"]
+            rate_d, rss_d = "{:+.0%}".format(rate_ratio - 1), "{:+.0%}".format(rss_ratio - 1)
+            if rate_ratio < 1 - tolerance or rss_ratio > 1 + tolerance:
+                regressions.append(key)
+        rate = "{:.1f} {}".format(cur["rate"], cur["unit"]) if cur["rate"] else "-"
+        print("{:<36} {:>18} {:>8} {:>9} {:>9}".format(key, rate, cur["peak_rss_mb"], rate_d, rss_d))
+    return regressions
+
+
+@click.command()
+@click.option("--sizes", default=SIZES, help="Comma separated inventory sizes")
+@click.option("--dpis", default=DPIS, help="Comma separated DPIs")
+@click.option("--stages", default=",".join(STAGES), help="Comma separated stages to run")
+@click.option("--max-labels", type=int, default=30, help="Labels rendered per make_label/make_simple_square case")
+@click.option("--max-pages", type=int, default=2, help="Pages tiled per tile/template_tile case")
+@click.option("-o", "--out", default="bench.json", help="Where to write results")
+@click.option("--baseline", default="bench_baseline.json", help="Results to compare against")
+@click.option("--update-baseline", is_flag=True, default=False, help="Store these results as the new baseline")
+@click.option("--tolerance", type=float, default=0.2, help="Allowed fractional slowdown or memory growth")
+@click.option("--startup-budget", type=float, default=STARTUP_BUDGET, help="Max seconds to import label")
+def main(sizes, dpis, stages, max_labels, max_pages, out, baseline, update_baseline, tolerance, startup_budget):
+    sizes = [int(s) for s in sizes.split(",")]
+    dpis = [int(d) for d in dpis.split(",")]
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    for stage in stages.split(","):
+        _, by_size, by_dpi = STAGES[stage]
+        for n in sizes if by_size else [None]:
+            for dpi in dpis if by_dpi else [None]:
+                key = case_key(stage, n, dpi)
+                print("Running {}...".format(key), file=sys.stderr)
+                with ctx.Pool(1) as pool:
+                    results[key] = pool.apply(run_case, (stage, n, dpi, max_labels, max_pages))
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+    }
+    with open(out, "w") as fout:
+        json.dump(report, fout, indent=1)
+    print("Wrote {}".format(out))
+
+    startup = results.get(case_key("startup", None, None))
+    over_budget = startup is not None and startup["seconds"] > startup_budget
+    if over_budget:
+        print(
+            "Importing label took {:.0f} ms, over the {:.0f} ms budget".format(
+                startup["seconds"] * 1000, startup_budget * 1000
+            )
+        )
+
+    if update_baseline:
+        with open(baseline, "w") as fout:
+            json.dump(report, fout, indent=1)
+        print("Updated baseline {}".format(baseline))
+        compare(results, {}, tolerance)
+        sys.exit(1 if over_budget else 0)
+    base = {}
+    if os.path.exists(baseline):
+        with open(baseline) as fin:
+            base = json.load(fin)["results"]
+    else:
+        print("No baseline at {}, run with --update-baseline to store one".format(baseline))
+    regressions = compare(results, base, tolerance)
+    if regressions:
+        print("{} regression(s) beyond {:.0%}: {}".format(len(regressions), tolerance, ", ".join(regressions)))
+        sys.exit(1)
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
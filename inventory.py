@@ -0,0 +1,148 @@
+"""Inventory statistics: what's stocked per category, subcat, gauge and diameter, and which threaded parts are
+missing their mates.
+
+    python inventory.py csvin            # report on a directory of inventory files (or a single file)
+    python inventory.py csvin --json     # the same as JSON
+
+The index is built in one pass and keeps only counts, never the items, so a million row inventory stays
+interactive. Use InventoryIndex directly to query it from other tools.
+"""
+import click
+import json
+import sys
+import time
+from collections import Counter
+from operator import attrgetter
+
+import label
+
+FIELDS = ("category", "subcat", "gauge", "diameter")  # What InventoryIndex.by() can group on
+_KEY = attrgetter("category", "subcat", "gauge")
+
+
+class InventoryIndex:
+    """Counts of items by (category, subcat, gauge), from which every other grouping is derived.
+
+    Items can be any objects with category, subcat and gauge attributes, e.g. label.Item. Groupings are computed
+    from the distinct keys rather than the items, and cached until more items are added. Per category queries
+    (subcats, gauges, ...) look their categories up in a per category index, built once in the same way.
+
+    """
+
+    def __init__(self, items=()):
+        self.counts = Counter()
+        self._views = {}
+        self.add(items)
+
+    def add(self, items):
+        """Index more items, in a single pass."""
+        self.counts.update(map(_KEY, items))
+        self._views = {}
+        return self
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def by(self, *fields):
+        """Item counts grouped by fields, each one of FIELDS. A single field gives plain keys, several give tuples."""
+        if fields not in self._views:
+            for f in fields:
+                if f not in FIELDS:
+                    raise ValueError("Can't group by {}, expected one of {}".format(f, ", ".join(FIELDS)))
+            grouped = Counter()
+            for (category, subcat, gauge), n in self.counts.items():
+                values = {"category": category, "subcat": subcat, "gauge": gauge}
+                values["diameter"] = label._diam_from_gauge(gauge)
+                key = tuple(values[f] for f in fields)
+                grouped[key[0] if len(key) == 1 else key] += n
+            self._views[fields] = grouped
+        return self._views[fields]
+
+    def per_category(self, field: str):
+        """Item counts grouped by field within each category, as {category: Counter}. Don't modify the Counters."""
+        key = ("per_category", field)
+        if key not in self._views:
+            index = {}
+            for (cat, value), n in self.by("category", field).items():
+                index.setdefault(cat, Counter())[value] = n
+            self._views[key] = index
+        return self._views[key]
+
+    def _matching(self, kind: str, field: str):
+        """Counts of field in each category whose name contains kind."""
+        return [counts for cat, counts in self.per_category(field).items() if kind in cat]
+
+    def subcats(self, category: str):
+        """Item counts per subcat of one category."""
+        return Counter(self.per_category("subcat").get(category, ()))
+
+    def gauges(self, kind: str):
+        """Set of gauges stocked in any category whose name contains kind, e.g. "screw" or "nut"."""
+        return set().union(*self._matching(kind, "gauge"))
+
+    def diameters(self, kind: str):
+        """Like gauges(), but thread diameters, e.g. "M3" for an "M3-0.5" gauge."""
+        return set().union(*self._matching(kind, "diameter"))
+
+    def screws_without_nuts(self):
+        """Screw gauges with no nut of the same gauge, sorted."""
+        return sorted(self.gauges("screw") - self.gauges("nut"))
+
+    def washers_by_diameter(self):
+        """Washer counts per diameter."""
+        return sum(self._matching("washer", "diameter"), Counter())
+
+    def diameters_without_washers(self):
+        """Diameters of screws and nuts with no washer of that diameter, sorted."""
+        return sorted((self.diameters("screw") | self.diameters("nut")) - set(self.washers_by_diameter()))
+
+    def to_dict(self):
+        categories = self.by("category")
+        return {
+            "total": self.total,
+            "categories": {cat: {"count": n, "subcats": dict(self.subcats(cat))} for cat, n in categories.items()},
+            "gauges": dict(self.by("gauge")),
+            "diameters": dict(self.by("diameter")),
+            "screws_without_nuts": self.screws_without_nuts(),
+            "washers_by_diameter": dict(self.washers_by_diameter()),
+            "diameters_without_washers": self.diameters_without_washers(),
+        }
+
+    def report(self):
+        """Human readable summary, like label-customsize's summarize_inventory used to print."""
+        categories = self.by("category")
+        lines = ["{} items in {} categories".format(self.total, len(categories))]
+        for cat in sorted(categories):
+            summary = ", ".join("{} {}".format(k, v) for k, v in sorted(self.subcats(cat).items()))
+            lines.append("  {}: {}".format(cat, summary))
+        if self.screws_without_nuts():
+            lines.append("The following screws have no nuts: {}".format(", ".join(self.screws_without_nuts())))
+        washers = self.washers_by_diameter()
+        if washers:
+            summary = ", ".join("{} {}".format(k, v) for k, v in sorted(washers.items()))
+            lines.append("Washers by diameter: {}".format(summary))
+        if self.diameters_without_washers():
+            lines.append("These diameters have no washers: {}".format(", ".join(self.diameters_without_washers())))
+        return "\n".join(lines)
+
+
+@click.command()
+@click.option("--json", "as_json", is_flag=True, default=False, help="Print the report as JSON")
+@click.option("-w", "--workers", type=int, default=label.INGEST_WORKERS, help="Inventory files read at once")
+@click.argument("inpath", default=label.INDIR)
+def main(as_json, workers, inpath):
+    start = time.perf_counter()
+    rejects = label.Rejects()
+    index = InventoryIndex(label.iter_items(inpath, workers=workers, rejects=rejects))
+    if rejects.summary():
+        print(rejects.summary(), file=sys.stderr if as_json else sys.stdout)
+    if as_json:
+        print(json.dumps(index.to_dict(), indent=1))
+    else:
+        print(index.report())
+        print("Indexed {} items in {:.2f}s".format(index.total, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
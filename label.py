@@ -1,17 +1,36 @@
 import click
+import contextlib
 import itertools
 import os
 import math
 import sys
 import csv
 import re
-from collections import namedtuple, defaultdict
-from PIL import Image, ImageDraw, ImageFont, ImageOps
+import functools
+import json
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple, OrderedDict, deque
+from collections.abc import Mapping, Sequence
+from PIL import Image, ImageChops, ImageFont
+# hashlib, queue, ImageDraw and ImageOps are imported where used, to keep importing label (e.g. for --help) fast
+# Optional and slow to import, so only imported on first use: see _import_reportlab and _import_numpy
+ImageReader = pdfmetrics = TTFont = pdf_canvas = None  # PDF output
+np = None  # NumPy compositor
 from itertools import chain
 
 from typing import List
 
-Item = namedtuple("Item", ["category", "subcat", "style", "gauge", "length", "notes"])
+# container: optional bin name, for --containers container. It isn't printed on part labels
+Item = namedtuple("Item", ["category", "subcat", "style", "gauge", "length", "notes", "container"], defaults=[""])
+# A bin of items, labeled by make_container_label
+Container = namedtuple("Container", ["name", "items"])
+# One step of a label layout: draw text `content` in `font`, or paste image `content`, with top left corner at `xy`
+Draw = namedtuple("Draw", ["kind", "xy", "content", "font"])
+# A composed page from render_batch, e.g. ("all_page0", <Image>)
+Page = namedtuple("Page", ["name", "image"])
 
 INDIR = "csvin"
 OUTDIR = "imout"
@@ -45,97 +64,890 @@ FONT_HEAD_SIZE_IN = 0.17  # HEADER TEXT
 FONT_SUB_SIZE_IN = 0.13  # SUBTEXT
 
 CONTAINER_LABELSIZE_IN = (2, 2)  # SIZE OF CONTAINER LABELS
+CUT_GAP_IN = 0  # Space left between labels laid out by pack_tile, for cutting them apart
+
+DRAFT_DPI = 150  # Resolution for --draft previews
+
+FONT_HEAD_FILE = "SourceSansPro-Semibold.ttf"
+FONT_SUB_FILE = "SourceSansPro-Regular.ttf"
+
+
+@functools.lru_cache(maxsize=None)
+def _truetype(path: str, size: int):
+    return ImageFont.truetype(path, size)
+
+
+def _import_reportlab():
+    """Import reportlab for PDF output. Returns False if it isn't installed."""
+    global ImageReader, pdfmetrics, TTFont, pdf_canvas
+    try:
+        from reportlab.lib.utils import ImageReader
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        from reportlab.pdfgen import canvas as pdf_canvas
+    except ImportError:
+        return False
+    return True
+
+
+def _import_numpy():
+    """Import NumPy for the NumPy compositor. Returns False if it isn't installed."""
+    global np
+    try:
+        import numpy as np
+    except ImportError:
+        return False
+    return True
+
+
+# Pipeline stages timed by --profile, and what one sample of each covers
+STAGE_UNITS = {
+    "load": "csv",
+    "decode": "image",
+    "thumbnail": "image",
+    "text": "string",
+    "label": "label",
+    "compose": "page",
+    "encode": "page",
+    "encode_label": "label",
+}
+
+
+class StageTimer:
+    """Wall-clock samples per pipeline stage, for --profile. Records nothing unless `enabled` is set."""
+
+    def __init__(self):
+        self.enabled = False
+        self.samples = {}
+
+    def record(self, name: str, seconds: float):
+        if self.enabled:
+            self.samples.setdefault(name, []).append(seconds)
+
+    def stage(self, name: str):
+        """Context manager timing its body as one sample of stage name."""
+        return self._timed(name) if self.enabled else contextlib.nullcontext()
+
+    @contextlib.contextmanager
+    def _timed(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name: str):
+        """Decorator timing each call as one sample of stage name."""
+
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def report(self):
+        """Per stage count, total, p50 and p95 seconds, in pipeline order."""
+        out = {}
+        for name in sorted(self.samples, key=lambda n: list(STAGE_UNITS).index(n) if n in STAGE_UNITS else 99):
+            s = sorted(self.samples[name])
+            out[name] = {
+                "per": STAGE_UNITS.get(name, "call"),
+                "count": len(s),
+                "total": sum(s),
+                "p50": s[max(0, math.ceil(0.50 * len(s)) - 1)],
+                "p95": s[max(0, math.ceil(0.95 * len(s)) - 1)],
+            }
+        return out
+
+
+TIMINGS = StageTimer()
+
+
+class Profile(
+    namedtuple(
+        "Profile",
+        [
+            "dpi",
+            "mode",
+            "base_dpi",
+            "papersize_in",
+            "margin_in",
+            "thumbsize_in",
+            "labelsize_in",
+            "font_head_size_in",
+            "font_sub_size_in",
+            "container_labelsize_in",
+            "container_thumbsize_in",
+            "simple_thumbsize_in",
+            "simple_labelsize_in",
+            "cellsize_in",
+            "cell_margin_in",
+            "cut_gap_in",
+        ],
+        defaults=[
+            DPI,
+            "RGBA",
+            DPI,
+            PAPERSIZE_IN,
+            MARGIN_IN,
+            THUMBSIZE_IN,
+            LABELSIZE_IN,
+            FONT_HEAD_SIZE_IN,
+            FONT_SUB_SIZE_IN,
+            CONTAINER_LABELSIZE_IN,
+            CONTAINER_THUMBSIZE_IN,
+            SIMPLE_THUMBSIZE_IN,
+            SIMPLE_LABELSIZE_IN,
+            CELLSIZE_IN,
+            CELL_MARGIN_IN,
+            CUT_GAP_IN,
+        ],
+    )
+):
+    """Render profile: color mode, DPI, and the inch sizes every pixel size and font is derived from.
+
+    The layout's few fixed pixel offsets were tuned at `base_dpi`, and are scaled by `offset()` so that a profile at
+    another DPI (e.g. `draft()`) has the same geometry in proportion.
+
+    """
+
+    __slots__ = ()
+
+    def px(self, size_in):
+        """Convert an inch size, or tuple of inch sizes, to pixels."""
+        if isinstance(size_in, tuple):
+            return tuple(int(s * self.dpi) for s in size_in)
+        return int(size_in * self.dpi)
+
+    def offset(self, px: int):
+        """Scale a pixel offset tuned at base_dpi to this profile."""
+        return int(px * self.dpi / self.base_dpi)
+
+    def draft(self, dpi: int = DRAFT_DPI):
+        """The same layout at a lower resolution, for fast previews."""
+        return self._replace(dpi=dpi)
+
+    @property
+    def papersize(self):
+        return self.px(self.papersize_in)
+
+    @property
+    def margin(self):
+        return self.px(self.margin_in)
+
+    @property
+    def thumbsize(self):
+        return self.px(self.thumbsize_in)
+
+    @property
+    def labelsize(self):
+        return self.px(self.labelsize_in)
+
+    @property
+    def container_labelsize(self):
+        return self.px(self.container_labelsize_in)
+
+    @property
+    def container_thumbsize(self):
+        return self.px(self.container_thumbsize_in)
+
+    @property
+    def simple_thumbsize(self):
+        return self.px(self.simple_thumbsize_in)
+
+    @property
+    def simple_labelsize(self):
+        return self.px(self.simple_labelsize_in)
+
+    @property
+    def cellsize(self):
+        return self.px(self.cellsize_in)
+
+    @property
+    def cell_margin(self):
+        return self.px(self.cell_margin_in)
+
+    @property
+    def cut_gap(self):
+        return self.px(self.cut_gap_in)
+
+    @property
+    def font_head(self):
+        return _truetype(FONT_HEAD_FILE, self.px(self.font_head_size_in))
+
+    @property
+    def font_sub(self):
+        return _truetype(FONT_SUB_FILE, self.px(self.font_sub_size_in))
+
+
+DEFAULT_PROFILE = Profile()
+# label-customsize's layouts: US letter at 300 DPI with a 0.25" margin all round, offsets tuned at that DPI
+CUSTOM_PROFILE = Profile(dpi=300, base_dpi=300, margin_in=(0.25, 0.25))
+# Named profiles for render_batch and label-customsize --preset
+PRESETS = {
+    "default": DEFAULT_PROFILE,
+    # Works best for wood screw / nail labels
+    "wood-screw": CUSTOM_PROFILE._replace(
+        thumbsize_in=(0.75, 0.2), labelsize_in=(1.8, 1.0), font_head_size_in=0.22, font_sub_size_in=0.12
+    ),
+    # Worked best for machine screw labels
+    "machine-screw": CUSTOM_PROFILE._replace(
+        thumbsize_in=(0.75, 0.15), labelsize_in=(1.0, 0.8), font_head_size_in=0.17, font_sub_size_in=0.09
+    ),
+    # Worked best for cable mgmt stuff
+    "cable-mgmt": CUSTOM_PROFILE._replace(
+        thumbsize_in=(0.75, 0.45), labelsize_in=(1.6, 1.3), font_head_size_in=0.17, font_sub_size_in=0.13
+    ),
+}
+
+BLANK_PATH = "img/misc.png"
 
-# Convert inch sizes to pixels
-THUMBSIZE = tuple(int(s * DPI) for s in THUMBSIZE_IN)
-LABELSIZE = tuple(int(s * DPI) for s in LABELSIZE_IN)
-CONTAINER_LABELSIZE = tuple(int(s * DPI) for s in CONTAINER_LABELSIZE_IN)
-CONTAINER_THUMBSIZE = tuple(int(s * DPI) for s in CONTAINER_THUMBSIZE_IN)
-SIMPLE_THUMBSIZE = tuple(int(s * DPI) for s in SIMPLE_THUMBSIZE_IN)
-SIMPLE_LABELSIZE = tuple(int(s * DPI) for s in SIMPLE_LABELSIZE_IN)
-PAPERSIZE = tuple(int(s * DPI) for s in PAPERSIZE_IN)
-MARGIN = (int(MARGIN_IN[0] * DPI), int(MARGIN_IN[1] * DPI))
-CELLSIZE = tuple(int(s * DPI) for s in CELLSIZE_IN)
-CELL_MARGIN = tuple(int(s * DPI) for s in CELL_MARGIN_IN)
-FONT_HEAD = ImageFont.truetype("SourceSansPro-Semibold.ttf", int(FONT_HEAD_SIZE_IN * DPI))
-FONT_SUB = ImageFont.truetype("SourceSansPro-Regular.ttf", int(FONT_SUB_SIZE_IN * DPI))
 
-BLANK_IM = Image.open("img/misc.png").convert("RGBA")
+@functools.lru_cache(maxsize=None)
+def _blank_im():
+    """Placeholder for images that are missing from an AssetRegistry."""
+    return Image.open(BLANK_PATH).convert("RGBA")
 
 
-def load_img_folder(path: str):
+ASSET_CACHE_MB = 256  # Max memory used by decoded images in each asset folder
+THUMB_MEM_MB = 256  # Max memory used by the thumbnails ThumbnailCache keeps, over all folders, sizes and modes
+ASSET_EXTS = (".png", ".webp", ".jpg", ".jpeg")  # Asset image formats, preferred in this order for the same name
+ASSET_WORKERS = 4  # Threads decoding assets at once in preload_assets
+REDUCING_GAP = 2.0  # Image.thumbnail's: a source this many times the thumbnail's size is decoded or reduced first
+RESAMPLE_MODES = ("RGBA", "RGB", "L")  # Modes thumbnail() resamples as is; others are converted to RGBA first
+
+
+class AssetRegistry(Mapping):
+    """Lazy map of fname to img for a folder of images.
+
+    The folder is only listed on first use, and an image is only decoded (and converted to RGBA) the first time it
+    is looked up. Decoded images are held in an LRU cache capped at `max_bytes`. Like the defaultdict it replaces,
+    indexing a missing fname returns _blank_im(), while `get()` returns the default. Safe to share between threads,
+    which decode at the same time.
+
+    Images are any of ASSET_EXTS, named by their file name without the extension. `open()` gives callers that only
+    need a thumbnail the file itself, so they can decode it at reduced size without going through the cache.
+
+    """
+
+    def __init__(self, path: str, max_bytes: int = ASSET_CACHE_MB * 2 ** 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._index = None
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._digests = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def _files(self):
+        if self._index is None:
+            index = {}
+            for imfile in sorted(os.listdir(self.path)):
+                fname, ext = os.path.splitext(imfile)
+                if ext.lower() not in ASSET_EXTS:
+                    continue
+                if fname.startswith("-"):  # allow prefix of "-N-" to specify order
+                    fname = "".join(fname.split("-")[2:])
+                old = index.get(fname)
+                if old is None or ASSET_EXTS.index(ext.lower()) < ASSET_EXTS.index(os.path.splitext(old)[1].lower()):
+                    index[fname] = os.path.join(self.path, imfile)
+            self._index = index
+        return self._index
+
+    def __getitem__(self, fname: str):
+        if fname not in self._files:
+            return _blank_im()
+        with self._lock:
+            img = self._cache.get(fname)
+            if img is not None:
+                self.hits += 1
+                self._cache.move_to_end(fname)
+                return img
+            self.misses += 1
+        # Decode outside the lock so threads wanting different images don't wait on each other
+        with TIMINGS.stage("decode"):
+            img = Image.open(self._files[fname]).convert("RGBA")
+        with self._lock:
+            if fname not in self._cache:  # Unless another thread got there first
+                self._cache[fname] = img
+                self._cache_bytes += _im_bytes(img)
+            while self._cache_bytes > self.max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= _im_bytes(evicted)
+            return img
+
+    def open(self, fname: str, size=None):
+        """Open fname's file (BLANK_PATH if missing) afresh, not yet decoded, bypassing the cache and its hit counts.
+
+        Given the size it's needed at, a JPEG at least REDUCING_GAP times bigger is set to decode at a reduced scale.
+
+        """
+        im = Image.open(self._files.get(fname, BLANK_PATH))
+        if size:
+            im.draft(None, (int(size[0] * REDUCING_GAP), int(size[1] * REDUCING_GAP)))
+        return im
+
+    def get(self, fname: str, default=None):
+        return self[fname] if fname in self._files else default
+
+    def digest(self, fname: str):
+        """Hash of the source file behind fname (BLANK_PATH if fname is missing)."""
+        import hashlib
+
+        path = self._files.get(fname, BLANK_PATH)
+        if path not in self._digests:
+            with open(path, "rb") as fin:
+                self._digests[path] = hashlib.sha1(fin.read()).hexdigest()
+        return self._digests[path]
+
+    def __contains__(self, fname):
+        return fname in self._files
+
+    def __iter__(self):
+        return iter(self._files)
+
+    def __len__(self):
+        return len(self._files)
+
+
+def _im_bytes(im: Image.Image):
+    """Approximate decoded size of an image in bytes."""
+    return im.size[0] * im.size[1] * len(im.getbands())
+
+
+class ThumbnailCache:
+    """Two-level cache of thumbnails, keyed by (image name, source file hash, target size, resample filter, mode).
+
+    Thumbnails are kept in memory in an LRU cache capped at `max_bytes`, which bounds a long running process (e.g.
+    labeld) however many folders, sizes and modes it serves, and, if `cache_dir` is set, saved there as PNGs so later
+    runs skip both decoding the source and resampling it. Simple mode's high contrast thumbnails (get_simple) are
+    cached the same way.
+
+    Sources are decoded straight from their files rather than through the registry's cache, so a full size image is
+    only ever held while its thumbnail is made: JPEGs decode at a reduced scale, other formats are reduce()d right
+    after decoding, and only the reduced image is converted to RGBA and then to the target mode.
+
+    """
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = THUMB_MEM_MB * 2 ** 20):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._mem = OrderedDict()
+        self._mem_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # For _mem and the counters, when thumbnails are built by preload_assets' threads
+
+    def get(self, registry: AssetRegistry, fname: str, size, resample=Image.BICUBIC, mode: str = "RGBA"):
+        """Return the thumbnail of registry[fname] that fits in size, converted to mode. Callers must not modify it."""
+
+        def build():
+            with TIMINGS.stage("decode"):
+                thumb = registry.open(fname, size)
+                if thumb.mode not in RESAMPLE_MODES:
+                    thumb = thumb.convert("RGBA")
+                thumb.load()
+            with TIMINGS.stage("thumbnail"):
+                thumb.thumbnail(size, resample)  # With REDUCING_GAP, so reduce() then resample
+                if thumb.mode != "RGBA":
+                    thumb = thumb.convert("RGBA")
+                return _to_mode(thumb, mode)
+
+        return self._get((fname, registry.digest(fname), tuple(size), resample, mode), build)
+
+    def get_simple(self, registry: AssetRegistry, fname: str, size):
+        """Return _simple_thumb(registry[fname], size), the high contrast thumbnail for simple mode."""
+        key = (fname, registry.digest(fname), tuple(size), "simple")
+
+        def build():
+            with TIMINGS.stage("decode"):
+                src = registry.open(fname, size).convert("RGBA")
+            return _simple_thumb(src, size)
+
+        return self._get(key, build)
+
+    def _get(self, key, build):
+        with self._lock:
+            thumb = self._mem.get(key)
+            if thumb is not None:
+                self.hits += 1
+                self._mem.move_to_end(key)
+                return thumb
+        path = None
+        if self.cache_dir:
+            import hashlib
+
+            path = os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode()).hexdigest() + ".png")
+        if path and os.path.exists(path):
+            try:
+                thumb = Image.open(path)
+                thumb.load()
+                with self._lock:
+                    self.disk_hits += 1
+            except OSError:  # Unreadable, e.g. left half written by a crash: treat it as a miss and rewrite it
+                thumb = None
+        if thumb is None:
+            with self._lock:
+                self.misses += 1
+            thumb = build()
+            if path:
+                self._save(thumb, path)
+        with self._lock:
+            if key not in self._mem:  # Unless another thread got there first
+                self._mem[key] = thumb
+                self._mem_bytes += _im_bytes(thumb)
+            while self._mem_bytes > self.max_bytes and len(self._mem) > 1:
+                _, evicted = self._mem.popitem(last=False)
+                self._mem_bytes -= _im_bytes(evicted)
+        return thumb
+
+    def _save(self, thumb: Image.Image, path: str):
+        """Write thumb to path atomically, so --jobs workers sharing cache_dir never read a partly written file."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = "{}.{}-{}.tmp".format(path, os.getpid(), threading.get_ident())
+        try:
+            thumb.save(tmp, format="PNG")
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def summary(self):
+        return "Thumbnail cache: {} hits, {} disk hits, {} misses".format(self.hits, self.disk_hits, self.misses)
+
+
+COLOR_MODES = {"rgba": "RGBA", "L": "L", "1": "1", "P": "P"}  # --color-mode choice -> PIL mode
+GRAY16_PALETTE = [v * 17 for v in range(16) for _ in range(3)]  # "P" mode: index 0 is black, 15 is white
+
+
+def _ink(mode: str):
+    return (0, 0, 0, 255) if mode == "RGBA" else 0
+
+
+def _new_canvas(size, mode: str = "RGBA", transparent: bool = False):
+    """White canvas in `mode`. Only RGBA canvases can be transparent, other modes are composited as ink on paper."""
+    if mode == "RGBA":
+        return Image.new("RGBA", size, color=(255, 255, 255, 0) if transparent else (255, 255, 255))
+    canvas = Image.new(mode, size, color={"L": 255, "1": 1, "P": 15}[mode])
+    if mode == "P":
+        canvas.putpalette(GRAY16_PALETTE)
+    return canvas
+
+
+def _to_mode(im: Image.Image, mode: str):
+    """Flatten im onto white and convert it to `mode`, dithering down to 1 bit.
+
+    Done once per thumbnail, so pastes in reduced modes need no alpha mask.
+
+    """
+    if mode == "RGBA" or im.mode == mode:
+        return im
+    flat = Image.new("RGB", im.size, color=(255, 255, 255))
+    flat.paste(im, mask=im.split()[-1] if im.mode == "RGBA" else None)
+    gray = flat.convert("L")
+    if mode == "P":
+        gray = gray.point(lambda v: round(v / 17))
+        gray.putpalette(GRAY16_PALETTE)
+        return gray
+    return gray.convert(mode)
+
+
+def _paste_ink(canvas: Image.Image, im: Image.Image, xy):
+    """Paste im over canvas, respecting im's alpha. Without alpha, the darker pixel wins, like ink on paper."""
+    if canvas.mode == "RGBA":
+        canvas.paste(im, xy, im)
+    else:
+        box = (xy[0], xy[1], xy[0] + im.size[0], xy[1] + im.size[1])
+        canvas.paste(ImageChops.darker(canvas.crop(box), im), xy)
+
+
+COMPOSITORS = ("pillow", "numpy")
+
+
+class PillowPage:
+    """A page composited with Pillow pastes, the default compositor."""
+
+    def __init__(self, im: Image.Image):
+        self.im = im
+
+    def scratch(self, size):
+        """A blank, transparent page to group labels on before pasting it onto this one."""
+        return PillowPage(_new_canvas(size, self.im.mode, transparent=True))
+
+    def paste_ink(self, im, xy):
+        _paste_ink(self.im, im.image() if isinstance(im, PillowPage) else im, xy)
+
+    def mark(self, xy, color):
+        self.im.putpixel(xy, color)
+
+    def image(self):
+        return self.im
+
+
+class ArrayPage:
+    """A page held as a NumPy array, with the same output as PillowPage pixel for pixel.
+
+    Opaque label pixels are placed by slice assignment, and only the box around translucent ones is blended, in one
+    vectorized step with Pillow's rounding: out = DIV255(dst * (255 - alpha) + src * alpha). Without alpha, pastes
+    keep the darker pixel like _paste_ink. Each label is analysed once per page, however many times it is pasted,
+    and the page becomes an Image once, in image().
+
+    """
+
+    def __init__(self, a, mode: str, palette=None):
+        self.a = a
+        self.mode = mode
+        self.palette = palette
+        self._layers = {}
+        self._scratch = {}
+        self._blank = None
+
+    @classmethod
+    def from_image(cls, im: Image.Image):
+        return cls(np.array(im), im.mode, im.getpalette() if im.mode == "P" else None)
+
+    @classmethod
+    def blank(cls, size, mode: str, transparent: bool = False):
+        """Same as _new_canvas(), without building the page as an Image first."""
+        px = _new_canvas((1, 1), mode, transparent)
+        px_a = np.asarray(px)
+        if mode == "RGBA":  # Fill a whole pixel at a time
+            a = np.full((size[1], size[0]), px_a.view(np.uint32)[0, 0], np.uint32)
+            a = a.view(np.uint8).reshape(size[1], size[0], 4)
+        else:
+            a = np.full((size[1], size[0]), px_a[0, 0], px_a.dtype)
+        return cls(a, mode, px.getpalette() if mode == "P" else None)
+
+    def scratch(self, size):
+        """Like PillowPage.scratch(), but reuses one buffer per size. Only one may be in use at a time."""
+        page = self._scratch.get(size)
+        if page is None:
+            page = self._scratch[size] = ArrayPage.blank(size, self.mode, transparent=True)
+            page._layers = self._layers
+            page._blank = page.a.copy()
+        else:
+            page.a[...] = page._blank
+        return page
+
+    def _layer(self, a):
+        """Split a into what can be copied and what must be blended.
+
+        Returns:
+            (array, box, array, array): a, the (y0, y1, x0, x1) box around its translucent pixels (or None) and,
+                within the box, src * alpha and 255 - alpha; or None if a is fully transparent
+
+        """
+        if self.mode != "RGBA":
+            return a, None, None, None
+        # Test whole pixels at a time: alpha is the last byte of each
+        opaque = np.frombuffer(bytes((0, 0, 0, 255)), np.uint32)[0]
+        alpha = np.ascontiguousarray(a).view(np.uint32).reshape(a.shape[:2]) & opaque
+        translucent = alpha != opaque
+        rows, cols = np.flatnonzero(translucent.any(1)), np.flatnonzero(translucent.any(0))
+        if not len(rows):
+            return a, None, None, None
+        if not alpha.any():
+            return None
+        box = (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+        sub = a[box[0] : box[1], box[2] : box[3]]
+        sub_alpha = sub[..., 3:].astype(np.uint16)
+        return a, box, sub * sub_alpha, 255 - sub_alpha
+
+    def paste_ink(self, im, xy):
+        if isinstance(im, ArrayPage):
+            layer = self._layer(im.a)
+        else:
+            cached = self._layers.get(id(im))
+            if cached is None:
+                cached = self._layers[id(im)] = (im, self._layer(np.asarray(im)))  # hold im so its id stays unique
+            layer = cached[1]
+        if layer is None:
+            return
+        a, box, premul, inv = layer
+        # Clip to the page like Image.paste. (sy, sx) is the clipped region's origin within a
+        x0, y0 = max(xy[0], 0), max(xy[1], 0)
+        x1, y1 = min(xy[0] + a.shape[1], self.a.shape[1]), min(xy[1] + a.shape[0], self.a.shape[0])
+        if x1 <= x0 or y1 <= y0:
+            return
+        dst = self.a[y0:y1, x0:x1]
+        sy, sx = y0 - xy[1], x0 - xy[0]
+        src = a[sy : sy + y1 - y0, sx : sx + x1 - x0]
+        if self.mode != "RGBA":
+            np.minimum(dst, src, out=dst)
+            return
+        blended = None
+        if box:
+            by0, by1 = max(box[0], sy), min(box[1], sy + y1 - y0)
+            bx0, bx1 = max(box[2], sx), min(box[3], sx + x1 - x0)
+            if by1 > by0 and bx1 > bx0:
+                under = dst[by0 - sy : by1 - sy, bx0 - sx : bx1 - sx]
+                weights = (slice(by0 - box[0], by1 - box[0]), slice(bx0 - box[2], bx1 - box[2]))
+                # In place where possible; stays < 2 ** 16 as the two weights sum to 255
+                blended = under * inv[weights]
+                blended += premul[weights]
+                blended += 128
+                blended += blended >> 8
+                blended >>= 8
+        dst[...] = src
+        if blended is not None:
+            dst[by0 - sy : by1 - sy, bx0 - sx : bx1 - sx] = blended
+
+    def mark(self, xy, color):
+        self.a[xy[1], xy[0]] = color
+
+    def image(self):
+        im = Image.fromarray(self.a)  # uint8 -> "L"/"RGBA", bool -> "1"
+        if self.palette:
+            im.putpalette(self.palette)  # "L" -> "P"
+        return im
+
+
+def _new_page(target_size, underlay=None, mode: str = "RGBA", compositor: str = "pillow"):
+    """A fresh sheet, as a PillowPage or ArrayPage."""
+    if compositor == "numpy":
+        if not _import_numpy():
+            raise ImportError("The NumPy compositor requires numpy (pip install numpy)")
+        if underlay:
+            return ArrayPage.from_image(_new_paper(target_size, underlay, mode))
+        return ArrayPage.blank(target_size, mode)
+    return PillowPage(_new_paper(target_size, underlay, mode))
+
+
+def load_img_folder(path: str, max_bytes: int = ASSET_CACHE_MB * 2 ** 20):
     """
     Returns:
-        dict(str, Image): map of fname to img
+        AssetRegistry: lazy map of fname to img
 
     """
-    fname_to_img = defaultdict(lambda: BLANK_IM)
-    for imfile in sorted(os.listdir(path)):
-        if "png" in imfile:
-            fname = imfile.replace(".png", "")
-            if fname.startswith("-"):  # allow prefix of "-N-" to specify order
-                fname = "".join(fname.split("-")[2:])
-            img = Image.open(os.path.join(path, imfile))
-            fname_to_img[fname] = img.convert("RGBA")
-    return fname_to_img
+    return AssetRegistry(path, max_bytes=max_bytes)
 
 
-def load_csv(fname: str):
-    """Load a single CSV into a list of Items.
+def preload_assets(fn, fnames, workers: int = ASSET_WORKERS):
+    """Call fn(fname) for each distinct fname on a pool of `workers` threads, e.g. to decode and thumbnail every
+    asset a run needs up front. Pillow releases the GIL while decoding, resampling and converting, so the threads
+    overlap.
+
+    """
+    fnames = list(dict.fromkeys(fnames))
+    if workers <= 1 or len(fnames) <= 1:
+        for fname in fnames:
+            fn(fname)
+        return
+    from concurrent.futures import ThreadPoolExecutor  # Imported here to keep startup fast
+
+    with ThreadPoolExecutor(min(workers, len(fnames))) as pool:
+        for _ in pool.map(fn, fnames):
+            pass
+
+
+def _preload_thumbs(items: list, profile: Profile = DEFAULT_PROFILE, workers: int = ASSET_WORKERS):
+    """Build the part label thumbnails of items ahead of rendering them."""
+    thumb = functools.partial(THUMBS.get, SUBCAT_IMS, size=profile.thumbsize, mode=profile.mode)
+    preload_assets(thumb, (_imname(i) for i in items), workers)
+
+
+INVENTORY_EXTS = (".csv", ".jsonl", ".ndjson")  # CSV, or JSON Lines with one object per row
+INGEST_WORKERS = 4  # Inventory files read at once by iter_items
+INGEST_BATCH = 512  # Items handed from a reader thread at a time
+INGEST_QUEUE = 8  # Batches buffered per file
+
+
+class Rejects:
+    """Tally of inventory rows that were skipped, to report once rather than per row."""
+
+    def __init__(self, max_examples: int = 3):
+        self.blank = 0
+        self.counts = {}
+        self.examples = []
+        self.max_examples = max_examples
+        self._lock = threading.Lock()
+
+    def add(self, fname: str, row):
+        with self._lock:
+            if isinstance(row, dict) and not any(v.strip() for v in row.values() if isinstance(v, str)):
+                self.blank += 1
+                return
+            self.counts[fname] = self.counts.get(fname, 0) + 1
+            if len(self.examples) < self.max_examples:
+                self.examples.append(row)
+
+    def summary(self):
+        """One line about the skipped rows, or None if there were none."""
+        if not self.blank and not self.counts:
+            return None
+        out = "Skipped {} blank rows".format(self.blank)
+        if self.counts:
+            out += " and rejected {} rows ({}); rows need a category, subcat and gauge, and a whole number qty".format(
+                sum(self.counts.values()),
+                ", ".join("{}: {}".format(os.path.basename(f), n) for f, n in sorted(self.counts.items())),
+            )
+            out += "\nFirst rejected: " + "; ".join(str(row) for row in self.examples)
+        return out
 
-    Items must have at least a category, subcat, and gauge (size).
+
+def _row_items(row: dict):
+    """The Items an inventory row stands for, or None if it isn't valid.
+
+    Items must have at least a category, subcat, and gauge (size). An optional "qty" column repeats the item that
+    many times, e.g. for parts stored in several bins; it defaults to 1. Missing columns are blank.
 
     """
-    items = []
+    qty = row.get("qty") or "1"
+    if not (row.get("gauge") and row.get("category") and row.get("subcat")) or not qty.strip().isdigit():
+        return None
+    return [Item._make([row.get(f, "") for f in Item._fields])] * int(qty)
+
+
+def _json_row(line: str):
+    """A JSON Lines row as a dict of strings like csv.DictReader's, or the line itself if it isn't an object."""
+    try:
+        row = json.loads(line)
+    except ValueError:
+        return line.rstrip("\n")
+    if not isinstance(row, dict):
+        return line.rstrip("\n")
+    return {k: "" if v is None else str(v) for k, v in row.items()}
+
+
+def _read_inventory(fname: str, rejects: "Rejects"):
+    """Yield the valid Items in one CSV or JSON Lines file, tallying the rest in rejects."""
     with open(fname) as fin:
-        reader = csv.DictReader(fin)
-        for row in reader:
-            if row["gauge"] and row["category"] and row["subcat"]:
-                items.append(Item(**row))
+        if fname.endswith(".csv"):
+            rows = csv.DictReader(fin, restval="")
+        else:
+            rows = (_json_row(line) for line in fin if line.strip())
+        for row in rows:
+            items = _row_items(row) if isinstance(row, dict) else None
+            if items is None:
+                rejects.add(fname, row)
             else:
-                print("Ignoring row")
-                print(row)
-    return items
+                yield from items
 
 
-def load_items(path: str = INDIR):
-    """Load all items in a path. If path is a single CSV, load it, otherwise assume path is a directory and
-    load all CSVs in the directory.
+def _item_batches(fname: str, rejects: Rejects):
+    """_read_inventory in lists of up to INGEST_BATCH Items, recording the time spent reading for --profile."""
+    items = _read_inventory(fname, rejects)
+    seconds = 0
+    while True:
+        start = time.perf_counter()
+        batch = list(itertools.islice(items, INGEST_BATCH))
+        seconds += time.perf_counter() - start
+        if not batch:
+            break
+        yield batch
+    TIMINGS.record("load", seconds)
+
+
+def _iter_concurrent(files: list, workers: int, rejects: Rejects):
+    """Read up to `workers` files at once on background threads, each into its own bounded queue, and yield their
+    batches in file order. A new file is only started once an earlier one has been consumed, so at most
+    workers * INGEST_QUEUE batches are ever buffered.
 
     """
-    if path.endswith(".csv"):
-        return load_csv(path)
+    import queue
+
+    stop = threading.Event()
+
+    def put(q, obj):
+        while not stop.is_set():
+            try:
+                q.put(obj, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def read(fname, q):
+        try:
+            for batch in _item_batches(fname, rejects):
+                if not put(q, batch):
+                    return
+            put(q, None)
+        except Exception as e:
+            put(q, e)
+
+    def start(fname):
+        q = queue.Queue(INGEST_QUEUE)
+        threading.Thread(target=read, args=(fname, q), daemon=True).start()
+        return q
+
+    files = iter(files)
+    pending = deque(start(f) for f in itertools.islice(files, workers))
+    try:
+        while pending:
+            for batch in iter(pending.popleft().get, None):
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+            pending.extend(start(f) for f in itertools.islice(files, 1))
+    finally:
+        stop.set()  # Unblock readers if the consumer stopped early
+
+
+def iter_items(path: str = INDIR, workers: int = INGEST_WORKERS, rejects: Rejects = None):
+    """Lazily yield the valid Items in path, in file then row order.
+
+    path is a single inventory file, or a directory of them (see INVENTORY_EXTS). Files are read concurrently but
+    memory use is bounded, however large the inventory. Invalid rows are tallied in `rejects`; if none is passed,
+    their summary is printed after the last Item.
+
+    """
+    report = rejects is None
+    if report:
+        rejects = Rejects()
+    if os.path.isdir(path):
+        files = [os.path.join(path, f) for f in os.listdir(path) if f.endswith(INVENTORY_EXTS)]
     else:
-        return list(
-            itertools.chain.from_iterable(
-                load_csv(os.path.join(path, f)) for f in os.listdir(path) if f.endswith(".csv")
-            )
-        )
+        files = [path]
+    if workers > 1 and len(files) > 1:
+        batches = _iter_concurrent(files, workers, rejects)
+    else:
+        batches = (batch for fname in files for batch in _item_batches(fname, rejects))
+    for batch in batches:
+        yield from batch
+    if report and rejects.summary():
+        print(rejects.summary())
+
+
+def load_csv(fname: str):
+    """Load a single CSV (or JSON Lines file) into a list of Items. See _row_items for what makes a valid row."""
+    return list(iter_items(fname))
+
+
+def load_items(path: str = INDIR):
+    """Load all items in a path. If path is a single inventory file, load it, otherwise assume path is a directory
+    and load all inventory files in the directory. Use iter_items to stream them instead.
+
+    """
+    return list(iter_items(path))
 
 
 CAT_IMS = load_img_folder("img/cat")
 SUBCAT_IMS = load_img_folder("img/subcat")
+THUMBS = ThumbnailCache()
 
 EXAMPLE_FRAC = "¹⁄₄"
+FRAC_RE = re.compile(r"(\d+)/(\d+)")
+SUPS = str.maketrans("0123456789", "⁰¹²³⁴⁵⁶⁷⁸⁹")
+SUBS = str.maketrans("0123456789", "₀₁₂₃₄₅₆₇₈₉")
+TEXT_CACHE_SIZE = 2 ** 16  # Max distinct strings memoized by to_unifrac and _text_size
+TEXT_MASK_CACHE_SIZE = 1024  # Max text masks memoized by _text_mask, ~100-140 KB each at 900 DPI
 
 
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
 def to_unifrac(text: str):
-    FRAC = "\u2044"
-    SUPS = dict(zip(u"0123456789", "⁰¹²³⁴⁵⁶⁷⁸⁹"))
-    SUBS = dict(zip(u"0123456789", "₀₁₂₃₄₅₆₇₈₉"))
-
-    def _tosup(s):
-        return "".join(SUPS[c] for c in s)
-
-    def _tosub(s):
-        return "".join(SUBS[c] for c in s)
-
-    m = re.search("(\d+)/(\d+)", text)
+    m = FRAC_RE.search(text)
     if m:
-        newmatch = _tosup(m.group(1)) + FRAC + _tosub(m.group(2))
-        newtext = text.replace(m.group(0), newmatch)
-        print("{} -> {}".format(text, newtext))
-        return newtext
+        newmatch = m.group(1).translate(SUPS) + "\u2044" + m.group(2).translate(SUBS)
+        return text.replace(m.group(0), newmatch)
     return text
 
 
@@ -144,6 +956,37 @@ def pretty_item(item: Item):
     return Item(**{k: to_unifrac(v) for k, v in item._asdict().items()})
 
 
+def dedupe_items(items: list):
+    """Collapse items that print identically.
+
+    Returns:
+        (list[Item], list[int]): the distinct pretty items in order of first appearance, and for each input item the
+            index of its label in that list
+
+    """
+    index = OrderedDict()
+    order = [index.setdefault(pretty_item(i._replace(container="")), len(index)) for i in items]
+    return list(index), order
+
+
+def place_labels(labels, order: list):
+    """Yield labels[order[0]], labels[order[1]], ... by reference.
+
+    labels may be a lazy iterator of the distinct labels in first-use order, as from dedupe_items; each is held only
+    until its last use so streaming stays bounded.
+
+    """
+    last_use = {u: n for n, u in enumerate(order)}
+    held = {}
+    labels = iter(labels)
+    for n, u in enumerate(order):
+        if u not in held:
+            held[u] = next(labels)
+        yield held[u]
+        if last_use[u] == n:
+            del held[u]
+
+
 def _center(obj: int, canvas: int):
     """Center object of a given width along a single dimension on canvas of a given width, return lower bound of
     object position.
@@ -156,8 +999,53 @@ def _imname(item):
     return "_".join([item.category, item.subcat])
 
 
-def _item_im(item):
-    return SUBCAT_IMS[_imname(item)].copy()
+def _item_thumb(item, profile: Profile = DEFAULT_PROFILE):
+    return THUMBS.get(SUBCAT_IMS, _imname(item), profile.thumbsize, mode=profile.mode)
+
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def _text_size(font: ImageFont.FreeTypeFont, text: str):
+    """Memoized width and height of text drawn from the origin, as the old font.getsize(text) gave them. Fonts come
+    from _truetype, so the same font and size is the same object.
+
+    """
+    _, _, right, bottom = font.getbbox(text)
+    return right, bottom
+
+
+@functools.lru_cache(maxsize=TEXT_MASK_CACHE_SIZE)
+def _text_mask(font: ImageFont.FreeTypeFont, text: str, fontmode: str):
+    """Rasterize text once into an "L" mask.
+
+    Returns:
+        (Image, (int, int)): the mask, or None for blank text, and its offset from the text origin
+
+    """
+    left, top, right, bottom = font.getbbox(text)
+    if right <= left or bottom <= top:
+        return None, (0, 0)
+    from PIL import ImageDraw
+
+    mask = Image.new("L", (right - left, bottom - top), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.fontmode = fontmode
+    draw.text((-left, -top), text, fill=255, font=font)
+    return mask, (left, top)
+
+
+@TIMINGS.timed("text")
+def _draw_text(canvas: Image.Image, xy, text: str, font: ImageFont.FreeTypeFont, fill):
+    """Same result as ImageDraw.Draw(canvas).text(xy, text, fill, font), pasting a cached mask of the text."""
+    fontmode = "1" if canvas.mode in ("1", "P", "I", "F") else "L"
+    mask, (left, top) = _text_mask(font, text, fontmode)
+    if mask is not None:
+        x, y = xy[0] + left, xy[1] + top
+        canvas.paste(fill, (x, y, x + mask.size[0], y + mask.size[1]), mask)
+
+
+def text_cache_summary():
+    info = [f.cache_info() for f in (_text_size, _text_mask, to_unifrac)]
+    return "Text cache: {} hits, {} misses".format(sum(i.hits for i in info), sum(i.misses for i in info))
 
 
 def _center_text_w(font: ImageFont, text: str, canvas_width: int):
@@ -167,7 +1055,7 @@ def _center_text_w(font: ImageFont, text: str, canvas_width: int):
         int
 
     """
-    textw = font.getsize(text)[0]
+    textw = _text_size(font, text)[0]
     return _center(textw, canvas_width)
 
 
@@ -182,235 +1070,1416 @@ def _snap_y(y: int, incr: int = 1):
 def _resize(im: Image.Image, desired):
     rx, ry = desired[0] / im.size[0], desired[1] / im.size[1]
     scale = min(rx, ry)
-    return im.resize((int(im.size[0] * scale), int(im.size[1] * scale)), Image.ANTIALIAS)
+    return im.resize((int(im.size[0] * scale), int(im.size[1] * scale)), Image.LANCZOS)
+
+@TIMINGS.timed("thumbnail")
+def _simple_thumb(img: Image.Image, thumbsize):
+    """Resize img to fit thumbsize and make it high contrast: equalized, then quantized to 12 colors.
+
+    Returns:
+        Image: RGBA, with the high contrast colors and the resized img's alpha
+
+    """
+    from PIL import ImageOps
 
-def make_simple_square(img: Image.Image, text, thumbsize=THUMBSIZE, labelsize=LABELSIZE, font=FONT_HEAD):
-    """Label with thumbnail centered, one line of text underneath"""
-    canvas = Image.new("RGBA", labelsize, color=(255, 255, 255, 0))
     thumbi = _resize(img.copy(), thumbsize)
     # thumbi = ImageOps.autocontrast(thumbi)
-    thumbi_hc = ImageOps.equalize(thumbi.convert("RGB"), mask=thumbi.split()[-1]).quantize(colors=12)
+    alpha = thumbi.split()[-1]
+    thumbi_hc = ImageOps.equalize(thumbi.convert("RGB"), mask=alpha).quantize(colors=12).convert("RGBA")
+    thumbi_hc.putalpha(alpha)
+    return thumbi_hc
+
+
+@TIMINGS.timed("label")
+def make_simple_square(
+    img: Image.Image,
+    text,
+    thumbsize=None,
+    labelsize=None,
+    font=None,
+    profile: Profile = DEFAULT_PROFILE,
+    thumb: Image.Image = None,
+):
+    """Label with thumbnail centered, one line of text underneath
+
+    Pass `thumb` (e.g. from THUMBS.get_simple) to reuse an already computed _simple_thumb(img, thumbsize).
+    """
+    thumbsize = thumbsize or profile.thumbsize
+    labelsize = labelsize or profile.labelsize
+    font = font or profile.font_head
+    mode = profile.mode
+    canvas = _new_canvas(labelsize, mode, transparent=True)
+    thumbi_hc = thumb if thumb is not None else _simple_thumb(img, thumbsize)
     # thumbi.thumbnail(thumbsize)
 
     # Thumbnail on left side
-    x = y = int(DPI * (1/16))
-    imx = _center_im_w(thumbi, labelsize[0])
-    imy = _center(thumbi.size[1], thumbsize[1])
-    canvas.paste(thumbi_hc, (imx, imy), mask=thumbi)
+    x = y = profile.px(1/16)
+    imx = _center_im_w(thumbi_hc, labelsize[0])
+    imy = _center(thumbi_hc.size[1], thumbsize[1])
+    if mode == "RGBA":
+        canvas.paste(thumbi_hc.convert("RGB"), (imx, imy), mask=thumbi_hc)
+    else:
+        canvas.paste(_to_mode(thumbi_hc, mode), (imx, imy))
     # canvas.paste(thumbi, (imx, imy))
     y += thumbsize[1]
     text_x = _center_text_w(font, text, canvas.size[0])
 
-    draw = ImageDraw.Draw(canvas)
-    draw.text((text_x, y), text, fill=(0,0,0,255), font=font)
+    _draw_text(canvas, (text_x, y), text, font, fill=_ink(mode))
 
     return canvas
 
 
-def make_simple_landscape_label(img: Image.Image, text, thumbsize=THUMBSIZE, labelsize=LABELSIZE, font=FONT_HEAD):
+def make_simple_landscape_label(
+    img: Image.Image, text, thumbsize=None, labelsize=None, font=None, profile: Profile = DEFAULT_PROFILE
+):
     """Label with thumbnail on left, one line of text on right"""
+    thumbsize = thumbsize or profile.thumbsize
+    labelsize = labelsize or profile.labelsize
+    font = font or profile.font_head
     canvas = Image.new("RGBA", labelsize, color=(255, 255, 255, 0))
     thumbi = img.copy()
     thumbi.thumbnail(thumbsize)
 
     # Thumbnail on left side
-    x = y = int(DPI * (1/8))
+    x = y = profile.px(1/8)
     canvas.paste(thumbi, (x, y), thumbi)
 
     x += thumbi.size[0]
 
     text_x = x + _center_text_w(font, text, canvas.size[0] - x)
 
-    draw = ImageDraw.Draw(canvas)
-    draw.text((text_x, y), text, fill=(0,0,0,255), font=FONT_HEAD)
+    _draw_text(canvas, (text_x, y), text, profile.font_head, fill=(0, 0, 0, 255))
 
     return canvas
 
 
 
-def make_label(item: Item, fout: str):
-    """Make a label for an individual item."""
-    canvas = Image.new("RGBA", LABELSIZE, color=(255, 255, 255))
-    subi = _item_im(item)
-    subi.thumbnail(THUMBSIZE)
+def _label_layout(item: Item, profile: Profile = DEFAULT_PROFILE):
+    """Lay out a part label, shared by the raster and PDF backends.
+
+    Returns:
+        list[Draw]: drawing steps, in paint order
+
+    """
+    subi = _item_thumb(item, profile)
+    labelsize = profile.labelsize
+    font_head, font_sub = profile.font_head, profile.font_sub
+    steps = []
 
     # Draw from top down, tracking vertical offset 'y'
-    y = 2
-    draw = ImageDraw.Draw(canvas)
+    y = profile.offset(2)
     header_text = item.gauge
     if item.length:
         header_text = header_text + " x {}".format(item.length)
-    textw = _center_text_w(FONT_HEAD, header_text, canvas.size[0])
-    draw.text((textw, y), header_text, fill=(0, 0, 0, 255), font=FONT_HEAD)
-    y = _snap_y(y + FONT_HEAD.getsize(EXAMPLE_FRAC)[1] + 10)
+    textw = _center_text_w(font_head, header_text, labelsize[0])
+    steps.append(Draw("text", (textw, y), header_text, font_head))
+    y = _snap_y(y + _text_size(font_head, EXAMPLE_FRAC)[1] + profile.offset(10))
 
-    subw = _center_im_w(subi, canvas.size[0])
-    canvas.paste(subi, (subw, y))
-    y = _snap_y(y + subi.size[1] + 10)
+    subw = _center_im_w(subi, labelsize[0])
+    steps.append(Draw("image", (subw, y), subi, None))
+    y = _snap_y(y + subi.size[1] + profile.offset(10))
 
     summary_text = "{} {}".format(item.subcat, item.category)
-    textw = _center_text_w(FONT_SUB, summary_text, canvas.size[0])
-    draw.text((textw, y), summary_text, fill=(0, 0, 0, 255), font=FONT_SUB)
-    y = _snap_y(y + FONT_SUB.getsize(summary_text)[1] + 10)
+    textw = _center_text_w(font_sub, summary_text, labelsize[0])
+    steps.append(Draw("text", (textw, y), summary_text, font_sub))
+    return steps
+
 
-    canvas.save(fout)
+@TIMINGS.timed("label")
+def make_label(item: Item, fout: str, profile: Profile = DEFAULT_PROFILE):
+    """Make a label for an individual item, saving it to fout unless fout is None."""
+    canvas = _new_canvas(profile.labelsize, profile.mode)
+    _draw_steps(canvas, _label_layout(item, profile), profile.mode)
+
+    if fout:
+        canvas.save(fout)
     return canvas
 
 
-def make_container_label(items: list, fout: str):
-    """Make a label for a container of multiple items. Picture of all item categories, text of all item sizes.
+def _draw_steps(canvas: Image.Image, steps, mode: str):
+    for step in steps:
+        if step.kind == "text":
+            _draw_text(canvas, step.xy, step.content, step.font, fill=_ink(mode))
+        else:
+            canvas.paste(step.content, step.xy)
 
-    Args:
-        items (list[Item]):
+
+def _container_layout(items: list, name: str = None, profile: Profile = DEFAULT_PROFILE):
+    """Lay out a container label, shared by the raster and PDF backends: a row of pictures of the items' categories,
+    the items' sizes, then the container's name if it adds anything.
+
+    Category thumbnails come from THUMBS, so they're built once and shared by every container. A row too wide for
+    the label is shrunk to fit. Sizes and name get unicode fractions, like the part labels' pretty_item text.
 
     Returns:
+        list[Draw]: drawing steps, in paint order
 
     """
-    container_cats = set(i.category for i in items)
-    container_subcats = set((i.category, i.subcat) for i in items)
-    container_diams = set(_diam_from_gauge(i.gauge) for i in items)
-    print(container_cats)
-    print(container_subcats)
-    print(container_diams)
+    labelsize = profile.container_labelsize
+    font_head, font_sub = profile.font_head, profile.font_sub
+    steps = []
 
     # Draw primary category images
-    y = 2
-    canvas = Image.new("RGBA", CONTAINER_LABELSIZE, color=(255, 255, 255))
-    catis = [CAT_IMS.get(c).copy() for c in container_cats if CAT_IMS.get(c)]
-    for ci in catis:
-        ci.thumbnail(CONTAINER_THUMBSIZE)
-    x_total = sum(ci.size[0] for ci in catis) + (len(catis) - 1) * 20
-    x = _center(x_total, canvas.size[0])
-    print(x, x_total, canvas.size[0])
+    y = profile.offset(2)
+    cats = sorted(set(i.category for i in items))
+    cats = [c for c in cats if c in CAT_IMS]
+    catis = [THUMBS.get(CAT_IMS, c, profile.container_thumbsize, mode=profile.mode) for c in cats]
+    gap = profile.offset(20)
+    room = labelsize[0] - (len(catis) - 1) * gap
+    if catis and sum(ci.size[0] for ci in catis) > room:
+        scale = room / sum(ci.size[0] for ci in catis)
+        catis = [
+            THUMBS.get(CAT_IMS, c, (int(ci.size[0] * scale), int(ci.size[1] * scale)), mode=profile.mode)
+            for c, ci in zip(cats, catis)
+        ]
+    x_total = sum(ci.size[0] for ci in catis) + (len(catis) - 1) * gap
+    x = _center(x_total, labelsize[0])
     for ci in catis:
-        canvas.paste(ci, (x, y))
-        x += ci.size[0] + 20
-    y = max(ci.size[1] for ci in catis) + 10
+        steps.append(Draw("image", (x, y), ci, None))
+        x += ci.size[0] + gap
+    if catis:
+        y = max(ci.size[1] for ci in catis) + profile.offset(10)
+
+    diams_text = ",  ".join(to_unifrac(d) for d in sorted(set(_diam_from_gauge(i.gauge) for i in items)))
+    name = name and to_unifrac(name)
+    steps.append(Draw("text", (_center_text_w(font_head, diams_text, labelsize[0]), y), diams_text, font_head))
+    if name and name != diams_text:
+        y = _snap_y(y + _text_size(font_head, EXAMPLE_FRAC)[1] + profile.offset(10))
+        steps.append(Draw("text", (_center_text_w(font_sub, name, labelsize[0]), y), name, font_sub))
+    return steps
+
+
+@TIMINGS.timed("label")
+def make_container_label(items: list, fout: str, profile: Profile = DEFAULT_PROFILE, name: str = None):
+    """Make a label for a container of multiple items. Picture of all item categories, text of all item sizes, and
+    the container's name. Saved to fout unless fout is None.
+
+    Args:
+        items (list[Item]):
 
-    draw = ImageDraw.Draw(canvas)
-    diams_text = ",  ".join(container_diams)
-    textw = _center_text_w(FONT_HEAD, diams_text, canvas.size[0])
-    draw.text((textw, y), diams_text, fill=(0, 0, 0, 255), font=FONT_HEAD)
+    Returns:
+        Image
+
+    """
+    canvas = _new_canvas(profile.container_labelsize, profile.mode)
+    _draw_steps(canvas, _container_layout(items, name, profile), profile.mode)
 
-    canvas.save(fout)
+    if fout:
+        canvas.save(fout)
     return canvas
 
 
+# --containers choice -> the key items are grouped into containers by
+CONTAINER_KEYS = {
+    "container": lambda item: item.container,
+    "diameter": lambda item: _diam_from_gauge(item.gauge),
+    "category": lambda item: item.category,
+    "gauge": lambda item: item.gauge,
+}
+
+
+def group_containers(items: list, key: str):
+    """Group items by CONTAINER_KEYS[key], in order of first appearance. Items with a blank key are left out.
+
+    Returns:
+        list[Container]
+
+    """
+    groups = OrderedDict()
+    for item in items:
+        name = CONTAINER_KEYS[key](item).strip()
+        if name:
+            groups.setdefault(name, []).append(item)
+    return [Container(name, group) for name, group in groups.items()]
+
+
 def _diam_from_gauge(gauge: str):
     return gauge.split("-")[0]
 
 
 def chunks(lst: list, n: int):
-    """Enumerate successive n-sized chunks from lst."""
-    for i in range(0, len(lst), n):
-        yield int(i / n), lst[i : i + n]
+    """Enumerate successive n-sized chunks from lst.
 
+    If lst is an iterator rather than a list, each chunk is a lazy iterator too. This keeps at most one element of lst
+    in memory at a time. Whatever the caller leaves of a chunk (e.g. labels below a template page's edge, which a
+    banded page never reaches) is used up before the next chunk starts, so chunks always hold n elements of lst.
 
-def template_tile(ims, cell_size, cell_margin = CELL_MARGIN, target_size=PAPERSIZE, underlay=None, skip_cells=0):
+    """
+    if isinstance(lst, Sequence):
+        for i in range(0, len(lst), n):
+            yield int(i / n), lst[i : i + n]
+        return
+    it = iter(lst)
+    for chunkno, first in enumerate(it):
+        rest = itertools.islice(it, n - 1)
+        yield chunkno, chain([first], rest)
+        for _ in rest:
+            pass
+
+
+@TIMINGS.timed("compose")
+def template_tile(
+    ims,
+    cell_size,
+    cell_margin=None,
+    target_size=None,
+    underlay=None,
+    skip_cells=0,
+    profile: Profile = DEFAULT_PROFILE,
+    compositor: str = "pillow",
+):
     """Tile to a template, grouping ims horizontally into `cell_size` chunks."""
+    cell_margin = cell_margin or profile.cell_margin
+    target_size = target_size or profile.papersize
+    mode, dpi, margin = profile.mode, profile.dpi, profile.margin
     imsize = ims[0].size
-    print("Image dimensions: {}x{} px, {:.2}x{:.2} in".format(imsize[0], imsize[1], imsize[0]/DPI, imsize[1]/DPI))
+    print("Image dimensions: {}x{} px, {:.2}x{:.2} in".format(imsize[0], imsize[1], imsize[0]/dpi, imsize[1]/dpi))
     cell_margin_x, cell_margin_y = cell_margin
     ims_per_cell = math.floor(cell_size[0] / ims[0].size[0])
-    cell_per_row = math.floor((target_size[0] + cell_margin_x - (2 * MARGIN[0])) / (cell_size[0] + cell_margin_x))
-    cell_per_col = math.floor((target_size[1] + cell_margin_y - (2 * MARGIN[1])) / (cell_size[1] + cell_margin_y))
+    cell_per_row = math.floor((target_size[0] + cell_margin_x - (2 * margin[0])) / (cell_size[0] + cell_margin_x))
+    cell_per_col = math.floor((target_size[1] + cell_margin_y - (2 * margin[1])) / (cell_size[1] + cell_margin_y))
     print(
         "{} labels per page ({} per row X {} per column X {} labels per cell)".format(
             cell_per_row * cell_per_col * ims_per_cell, cell_per_row, cell_per_col, ims_per_cell
         )
     )
-    if underlay:
-        paper = underlay.copy()
-        paper.thumbnail(target_size)
-    else:
-        paper = Image.new("RGBA", target_size, color=(255, 255, 255))
+    paper = _new_page(target_size, underlay, mode, compositor)
     for cellno, cell_ims in chunks(ims, ims_per_cell):
         cellno += skip_cells
-        cell_im = Image.new("RGBA", cell_size, color=(255, 255, 255, 0))
+        cell_im = paper.scratch(cell_size)
         for imno, im in enumerate(cell_ims):
             im_x_center = (imsize[0] / 2) + (imno) * ((cell_size[0]-imsize[0]) / (ims_per_cell - 1))
             im_x = int(im_x_center - .5 * imsize[0])
-            cell_im.paste(im, (im_x, 0), im)
+            cell_im.paste_ink(im, (im_x, 0))
         col = cellno % cell_per_row
         row = math.floor(cellno / cell_per_row)
-        cellx = MARGIN[0] + (cell_size[0] + cell_margin[0]) * col
-        celly = MARGIN[1] + (cell_size[1] + cell_margin[1]) * row
+        cellx = margin[0] + (cell_size[0] + cell_margin[0]) * col
+        celly = margin[1] + (cell_size[1] + cell_margin[1]) * row
         # Mark cell corners
         for px in ((0, 0), (cell_size[0]-1, 0), (cell_size[0]-1, cell_size[1]-1), (0, cell_size[1]-1)):
-            cell_im.putpixel(px, (0, 0, 0, 255))
-        paper.paste(cell_im, (cellx, celly), cell_im)
-    return paper
+            cell_im.mark(px, _ink(mode))
+        paper.paste_ink(cell_im, (cellx, celly))
+    return paper.image()
 
 
+def _new_paper(target_size, underlay=None, mode: str = "RGBA"):
+    if underlay:
+        paper = underlay.copy()
+        paper.thumbnail(target_size)
+        return _to_mode(paper, mode)
+    return _new_canvas(target_size, mode)
+
+
+
+PAGE_FORMATS = {"png": "png", "tiff": "tif", "bmp": "bmp", "pbm": "pbm"}  # format -> file extension
+PROOF_COMPRESS_LEVEL = 1
+LABEL_BACKLOG = 64  # Labels queued for --labels-out writes before rendering waits on the disk
+LABEL_BACKLOG_STREAM_MB = 32  # With --stream, the --labels-out backlog is as many labels as fit in this much memory
+BAND_ROWS = 128  # Rows of a page composed and encoded at a time with --bands, ~4 MB for RGBA at 900 DPI
+_INVERT = bytes(255 - b for b in range(256))
+
+
+def _to_bilevel(im: Image.Image):
+    """im as 1 bit, thresholded rather than dithered so that bands of a page convert the same as the whole page."""
+    return im if im.mode == "1" else im.convert("L").convert("1", dither=Image.NONE)
+
+
+class PngRowWriter:
+    """Streaming PNG encoder: the image is written a band of rows at a time, and never held whole.
+
+    Rows are stored unfiltered, in IDAT chunks as zlib produces them.
+
+    """
+
+    # mode -> (bit depth, PNG color type, PIL raw mode). P pages only use GRAY16_PALETTE, so need 4 bits
+    COLOR_TYPES = {"RGBA": (8, 6, "RGBA"), "L": (8, 0, "L"), "1": (1, 0, "1"), "P": (4, 3, "P;4")}
+
+    def __init__(self, fout: str, size, mode: str, palette=None, compress_level: int = None):
+        depth, color_type, self._rawmode = self.COLOR_TYPES[mode]
+        self._fout = open(fout, "wb")
+        self._fout.write(b"\x89PNG\r\n\x1a\n")
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", size[0], size[1], depth, color_type, 0, 0, 0))
+        if mode == "P":
+            self._chunk(b"PLTE", bytes(palette))
+        self._zlib = zlib.compressobj(6 if compress_level is None else compress_level)
+
+    def _chunk(self, kind: bytes, data: bytes):
+        self._fout.write(struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data)))
+
+    def write(self, band: Image.Image):
+        raw = band.tobytes("raw", self._rawmode)
+        stride = len(raw) // band.size[1]
+        data = self._zlib.compress(b"".join(b"\0" + raw[i : i + stride] for i in range(0, len(raw), stride)))
+        if data:
+            self._chunk(b"IDAT", data)
+
+    def close(self):
+        self._chunk(b"IDAT", self._zlib.flush())
+        self._chunk(b"IEND", b"")
+        self._fout.close()
+
+
+class PbmRowWriter:
+    """Streaming binary PBM (P4) encoder, the 1 bit raster printers take, written a band of rows at a time."""
+
+    def __init__(self, fout: str, size, mode: str = "1", palette=None, compress_level: int = None):
+        self._fout = open(fout, "wb")
+        self._fout.write("P4\n{} {}\n".format(*size).encode())
+
+    def write(self, band: Image.Image):
+        self._fout.write(_to_bilevel(band).tobytes().translate(_INVERT))  # PIL's 1 bits are white, PBM's are black
+
+    def close(self):
+        self._fout.close()
+
+
+BAND_ENCODERS = {"png": PngRowWriter, "pbm": PbmRowWriter}
+
+
+class ImageWriter:
+    """Encode and save images on a bounded pool of background threads, so the next page can be composited while
+    the last one is being written.
+
+    At most `max_pending` images are queued or encoding at once, and `save()` blocks beyond that, which bounds the
+    memory held by finished pages. Call `close()` to wait for all writes and print their timings.
+
+    With `band_rows`, `save_page()` instead composes each page a band of that many rows at a time and streams the
+    bands into a BAND_ENCODERS encoder, so no whole page is ever held in memory, whatever the DPI.
+
+    Each time `save()` has to wait for the backlog to drain is counted as a stall, and `close()` reports the stalls
+    along with the write throughput. Encode times are recorded under TIMINGS stage `stage`.
+
+    """
+
+    def __init__(
+        self,
+        fmt: str = "png",
+        compress_level: int = None,
+        workers: int = 2,
+        max_pending: int = 2,
+        band_rows: int = None,
+        name: str = "images",
+        verbose: bool = True,
+        stage: str = "encode",
+    ):
+        if band_rows and fmt not in BAND_ENCODERS:
+            raise ValueError("Banded pages can only be written as {}".format(", ".join(BAND_ENCODERS)))
+        self.fmt = fmt
+        self.ext = PAGE_FORMATS[fmt]
+        self.compress_level = compress_level
+        self.band_rows = band_rows
+        self.name = name
+        self.verbose = verbose
+        self.stage = stage
+        self.timings = []
+        self.stalls = []  # Seconds save() spent waiting for a free slot, each time it had to
+        self.bytes = 0
+        self._started = None
+        self._lock = threading.Lock()
+        from concurrent.futures import ThreadPoolExecutor  # Imported here to keep startup fast, like multiprocessing
+
+        self._pool = ThreadPoolExecutor(workers)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._futures = []
+
+    def save(self, im: Image.Image, fout: str):
+        if self._started is None:
+            self._started = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            start = time.perf_counter()
+            self._slots.acquire()
+            self.stalls.append(time.perf_counter() - start)
+        future = self._pool.submit(self._save, im, fout)
+        future.add_done_callback(lambda _: self._slots.release())
+        # Drop finished writes, re-raising any error from them, so a long run doesn't accumulate futures. Locked,
+        # as threads sharing a writer (e.g. label-customsize's presets) would otherwise lose each other's futures
+        with self._lock:
+            done = [f for f in self._futures if f.done()]
+            self._futures = [f for f in self._futures if not f.done()] + [future]
+        for f in done:
+            f.result()
+
+    def save_page(
+        self, placed, target_size, fout: str, underlay=None, profile: Profile = DEFAULT_PROFILE, compositor="pillow"
+    ):
+        """Compose a page from (label, xy) pairs and save it to fout."""
+        if self.band_rows:
+            self._save_banded(placed, target_size, fout, underlay, profile)
+        else:
+            self.save(_compose_placed(placed, target_size, underlay, profile, compositor), fout)
+
+    def _save_banded(self, placed, target_size, fout: str, underlay=None, profile: Profile = DEFAULT_PROFILE):
+        start = time.perf_counter()
+        if self._started is None:
+            self._started = start
+        mode = profile.mode
+        # thumbnail() never enlarges, so the scaled underlay is at most the template's own size, at any DPI
+        paper = _new_paper(target_size, underlay, mode) if underlay else None
+        width, height = paper.size if paper else target_size
+        encoder = BAND_ENCODERS[self.fmt](
+            fout, (width, height), mode, GRAY16_PALETTE if mode == "P" else None, self.compress_level
+        )
+        if isinstance(placed, Sequence):  # e.g. pack_tile's, in packing order
+            placed = sorted(placed, key=lambda p: p[1][1])
+        # Labels are pulled from placed only when the band reaching their top edge is composed, and let go after the
+        # band reaching their bottom, so a lazy placed (tile() when streaming) holds only the labels across one band
+        placed = iter(placed)
+        active = []
+        upcoming = next(placed, None)
+        try:
+            for top in range(0, height, self.band_rows):
+                bottom = min(top + self.band_rows, height)
+                while upcoming is not None and upcoming[1][1] < bottom:
+                    active.append(upcoming)
+                    upcoming = next(placed, None)
+                if paper:
+                    band = paper.crop((0, top, width, bottom))
+                else:
+                    band = _new_canvas((width, bottom - top), mode)
+                for label, (x, y) in active:
+                    if y + label.size[1] > top:
+                        _paste_ink(band, label, (x, y - top))
+                active = [(label, xy) for label, xy in active if xy[1] + label.size[1] > bottom]
+                encoder.write(band)
+        finally:
+            encoder.close()
+        self._wrote(fout, time.perf_counter() - start)  # Composing and encoding are interleaved, so both count
+
+    def _save(self, im: Image.Image, fout: str):
+        if self.fmt == "pbm":
+            im = _to_bilevel(im)
+        kwargs = {}
+        if self.compress_level is not None and fout.lower().endswith(".png"):
+            kwargs["compress_level"] = self.compress_level
+        start = time.perf_counter()
+        im.save(fout, **kwargs)
+        self._wrote(fout, time.perf_counter() - start)
+
+    def _wrote(self, fout: str, elapsed: float):
+        size = os.path.getsize(fout)
+        with self._lock:
+            self.timings.append(elapsed)
+            self.bytes += size
+        TIMINGS.record(self.stage, elapsed)
+        if self.verbose:
+            print("Wrote {} in {:.2f}s".format(fout, elapsed))
+
+    def close(self):
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()  # re-raise any error from the writer threads
+        self._pool.shutdown()
+        if self.timings:
+            wall = time.perf_counter() - self._started
+            print(
+                "Encoded {} {} ({:.1f} MB) in {:.2f}s (max {:.2f}s); {:.1f} {}/s, {:.1f} MB/s over {:.2f}s".format(
+                    len(self.timings),
+                    self.name,
+                    self.bytes / 2 ** 20,
+                    sum(self.timings),
+                    max(self.timings),
+                    len(self.timings) / wall,
+                    self.name,
+                    self.bytes / 2 ** 20 / wall,
+                    wall,
+                )
+            )
+        if self.stalls:
+            print(
+                "Waited on the {} write backlog {} times, {:.2f}s in all".format(
+                    self.name, len(self.stalls), sum(self.stalls)
+                )
+            )
+
+
+class PdfSheets:
+    """Multi-page PDF output with vector text.
+
+    Pixel coordinates from the raster layout are scaled to points, so pages match the PNG output at any DPI. Text
+    is drawn with the bundled TrueType fonts, and each distinct image is embedded once as an image XObject and
+    reused by every label that shows it. Requires reportlab.
+
+    """
+
+    def __init__(self, fout: str, profile: Profile = DEFAULT_PROFILE):
+        if not _import_reportlab():
+            raise ImportError("PDF output requires reportlab (pip install reportlab)")
+        self.fout = fout
+        self.profile = profile
+        self.scale = 72 / profile.dpi
+        target_size = profile.papersize
+        self.height = target_size[1] * self.scale
+        self.canvas = pdf_canvas.Canvas(fout, pagesize=(target_size[0] * self.scale, self.height))
+        self._images = {}
+        self.pages = 0
+
+    def _font_name(self, font: ImageFont.FreeTypeFont):
+        name = os.path.splitext(os.path.basename(font.path))[0]
+        if name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(name, font.path))
+        return name
+
+    def draw_text(self, xy, text: str, font: ImageFont.FreeTypeFont):
+        """Draw text with its top left at pixel position xy, like ImageDraw.text."""
+        ascent, _ = font.getmetrics()
+        self.canvas.setFont(self._font_name(font), font.size * self.scale)
+        self.canvas.drawString(xy[0] * self.scale, self.height - (xy[1] + ascent) * self.scale, text)
+
+    def draw_image(self, xy, im: Image.Image):
+        """Draw im with its top left at pixel position xy, at the size it would have in the raster output."""
+        reader = self._images.get(id(im))
+        if reader is None:
+            reader = self._images[id(im)] = (ImageReader(im), im)
+        w, h = im.size[0] * self.scale, im.size[1] * self.scale
+        self.canvas.drawImage(reader[0], xy[0] * self.scale, self.height - xy[1] * self.scale - h, w, h, mask="auto")
+
+    def draw_label(self, xy, item: Item):
+        self._draw_steps(xy, _label_layout(item, self.profile))
+
+    def draw_container(self, xy, container: Container):
+        self._draw_steps(xy, _container_layout(container.items, container.name, self.profile))
+
+    def _draw_steps(self, xy, steps):
+        for step in steps:
+            pos = (xy[0] + step.xy[0], xy[1] + step.xy[1])
+            if step.kind == "text":
+                self.draw_text(pos, step.content, step.font)
+            else:
+                self.draw_image(pos, step.content)
+
+    def show_page(self):
+        self.canvas.showPage()
+        self.pages += 1
+
+    def save(self):
+        self.canvas.save()
+        print("Wrote {} pages to {}".format(self.pages, self.fout))
+
+
+def _tile_grid(target_size, imsize, margin):
+    """Labels per row and per column that fit on a page inside margin."""
+    l_per_row = math.floor((target_size[0] - (2 * margin[0])) / imsize[0])
+    l_per_col = math.floor((target_size[1] - (2 * margin[1])) / imsize[1])
+    return l_per_row, l_per_col
+
+
+def _tile_xy(i: int, l_per_row: int, imsize, margin):
+    """Top left pixel position of the i'th label on a page."""
+    col = i % l_per_row
+    row = math.floor(i / l_per_row)
+    return col * imsize[0] + margin[0], row * imsize[1] + margin[1]
+
+
+def pdf_tile(pdf: PdfSheets, labels, target_size, imsize, draw):
+    """Same layout as tile(), appending pages to `pdf`. Calls draw(xy, label) to draw each label."""
+    margin = pdf.profile.margin
+    l_per_row, l_per_col = _tile_grid(target_size, imsize, margin)
+    for pageno, pagelabels in chunks(labels, int(l_per_col * l_per_row)):
+        for i, label in enumerate(pagelabels):
+            draw(_tile_xy(i, l_per_row, imsize, margin), label)
+        pdf.show_page()
+
 
 # Tile labels onto paper
-def tile(ims, target_size, imsize, out_label, rethumb=False, underlay=None):
-    l_per_row = math.floor((target_size[0] - (2 * MARGIN[0])) / imsize[0])
-    l_per_col = math.floor((target_size[1] - (2 * MARGIN[1])) / imsize[1])
-    n_pages = math.ceil(len(ims) / (l_per_row * l_per_col))
+def tile(
+    ims,
+    target_size,
+    imsize,
+    out_label,
+    rethumb=False,
+    underlay=None,
+    writer: ImageWriter = None,
+    profile: Profile = DEFAULT_PROFILE,
+    compositor: str = "pillow",
+):
+    """Tile labels onto pages, saving each page as `<out_label>_page<N>.<ext>`.
+
+    Pages are handed to `writer` to encode in the background. If no writer is given, one is created and closed
+    before returning.
+
+    """
+    own_writer = writer is None
+    if own_writer:
+        writer = ImageWriter()
+    margin = profile.margin
+    l_per_row, l_per_col = _tile_grid(target_size, imsize, margin)
+    # ims may be a generator when streaming, in which case the page count isn't known up front
+    n_pages = math.ceil(len(ims) / (l_per_row * l_per_col)) if isinstance(ims, Sequence) else "?"
     print(
         "{} labels per page ({} per row X {} per column), {} pages".format(
             l_per_row * l_per_col, l_per_row, l_per_col, n_pages
         )
     )
     for pageno, pagelabels in chunks(ims, int(l_per_col * l_per_row)):
-        if underlay:
-            paper = underlay.copy()
-            paper.thumbnail(target_size)
+        fout = "{}_page{}.{}".format(out_label, pageno, writer.ext)
+        placed = _grid_placements(pagelabels, target_size, imsize, rethumb, profile)
+        writer.save_page(placed, target_size, fout, underlay, profile, compositor)
+    if own_writer:
+        writer.close()
+
+
+def _grid_placements(pagelabels, target_size, imsize, rethumb=False, profile: Profile = DEFAULT_PROFILE):
+    """Yield (label, xy) for one page worth of labels, on tile()'s grid."""
+    margin = profile.margin
+    l_per_row, _ = _tile_grid(target_size, imsize, margin)
+    for i, label in enumerate(pagelabels):
+        # Duplicate labels are the same image object, so only copy when about to modify
+        if rethumb:
+            label = label.copy()
+            label.thumbnail((imsize[0] - profile.offset(10), imsize[1] - profile.offset(10)))
+        yield label, _tile_xy(i, l_per_row, imsize, margin)
+
+
+@TIMINGS.timed("compose")
+def _compose_placed(placed, target_size, underlay=None, profile: Profile = DEFAULT_PROFILE, compositor="pillow"):
+    """Paste (label, xy) pairs onto a fresh sheet."""
+    paper = _new_page(target_size, underlay, profile.mode, compositor)
+    for label, xy in placed:
+        paper.paste_ink(label, xy)
+    return paper.image()
+
+
+def pack_shelves(sizes, target_size, margin, gap: int = 0):
+    """Lay out rectangles of mixed sizes on as few pages as possible, with first fit decreasing height shelf packing.
+
+    Rectangles are placed tallest first, left to right along shelves: each goes on the first shelf (on any page)
+    with room for it, else starts a new shelf at the bottom of the first page with room, else a new page. Pages are
+    target_size inside margin, and neighbouring rectangles are `gap` apart. Shelves and pages are dropped from the
+    search once nothing else fits on them, which keeps large jobs fast.
+
+    Returns:
+        list[list[tuple]]: for each page, (index into sizes, top left xy) of the rectangles on it
+
+    """
+    width = target_size[0] - 2 * margin[0] + gap
+    height = target_size[1] - 2 * margin[1] + gap
+    for w, h in sizes:
+        if w + gap > width or h + gap > height:
+            raise ValueError("A {}x{} label doesn't fit inside the page margins".format(w, h))
+    if not sizes:
+        return []
+    min_w = min(w for w, _ in sizes) + gap
+    min_h = min(h for _, h in sizes) + gap
+    pages = []
+    open_pages = []  # [page number, height left] of pages with room for another shelf
+    open_shelves = []  # [page number, y, shelf height, x of next label] of shelves with room for another label
+    for i in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        w, h = sizes[i][0] + gap, sizes[i][1] + gap
+        for shelf in open_shelves:
+            if shelf[3] + w <= width and h <= shelf[2]:
+                break
         else:
-            paper = Image.new("RGBA", target_size, color=(255, 255, 255))
-        for i, label in enumerate(pagelabels):
-            col = i % l_per_row
-            row = math.floor(i / l_per_row)
-            x, y = col * imsize[0] + MARGIN[0], row * imsize[1] + MARGIN[1]
-            # print("col {}, row {} -> ({}., {})".format(col, row, x, y))
-            label_copy = label.copy()
-            if rethumb:
-                thumbsize = imsize[0] - 10, imsize[1] - 10
-                label_copy.thumbnail(thumbsize)
-            paper.paste(label_copy, (x, y), label_copy)
-        paper.save("{}_page{}.png".format(out_label, pageno))
+            for page in open_pages:
+                if page[1] >= h:
+                    break
+            else:
+                page = [len(pages), height]
+                pages.append([])
+                open_pages.append(page)
+            shelf = [page[0], height - page[1], h, 0]
+            open_shelves.append(shelf)
+            page[1] -= h
+            if page[1] < min_h:
+                open_pages.remove(page)
+        pages[shelf[0]].append((i, (margin[0] + shelf[3], margin[1] + shelf[1])))
+        shelf[3] += w
+        if shelf[3] + min_w > width:
+            open_shelves.remove(shelf)
+    return pages
+
+
+def pack_utilization(sizes, n_pages: int, target_size, margin):
+    """Fraction of the printable area of n_pages covered by rectangles of the given sizes."""
+    area = (target_size[0] - 2 * margin[0]) * (target_size[1] - 2 * margin[1])
+    return sum(w * h for w, h in sizes) / (n_pages * area) if n_pages else 0
+
+
+def pack_tile(
+    ims,
+    target_size,
+    out_label,
+    underlay=None,
+    writer: ImageWriter = None,
+    profile: Profile = DEFAULT_PROFILE,
+    compositor: str = "pillow",
+):
+    """Like tile(), but for labels of mixed sizes (e.g. part labels with container thumbnails), laid out by
+    pack_shelves with profile.cut_gap between them rather than on a grid.
+
+    Returns:
+        float: the fraction of the pages' printable area covered by labels
+
+    """
+    own_writer = writer is None
+    if own_writer:
+        writer = ImageWriter()
+    ims = list(ims)
+    sizes = [im.size for im in ims]
+    pages = pack_shelves(sizes, target_size, profile.margin, profile.cut_gap)
+    utilization = pack_utilization(sizes, len(pages), target_size, profile.margin)
+    print("Packed {} labels onto {} pages, {:.0%} of the printable area".format(len(ims), len(pages), utilization))
+    for pageno, placed in enumerate(pages):
+        fout = "{}_page{}.{}".format(out_label, pageno, writer.ext)
+        writer.save_page([(ims[i], xy) for i, xy in placed], target_size, fout, underlay, profile, compositor)
+    if own_writer:
+        writer.close()
+    return utilization
+
+
+def _grid_pages(
+    ims,
+    target_size,
+    imsize,
+    name: str,
+    rethumb=False,
+    underlay=None,
+    profile: Profile = DEFAULT_PROFILE,
+    compositor: str = "pillow",
+):
+    """Like tile(), but yield each page as a Page rather than saving it."""
+    l_per_row, l_per_col = _tile_grid(target_size, imsize, profile.margin)
+    for pageno, pagelabels in chunks(ims, int(l_per_col * l_per_row)):
+        placed = _grid_placements(pagelabels, target_size, imsize, rethumb, profile)
+        paper = _compose_placed(placed, target_size, underlay, profile, compositor)
+        yield Page("{}_page{}".format(name, pageno), paper)
+
+
+def render_batch(
+    items: list,
+    profile: Profile = DEFAULT_PROFILE,
+    container: bool = False,
+    underlay=None,
+    compositor: str = "pillow",
+    label_writer: ImageWriter = None,
+    label_dir: str = OUTDIR,
+):
+    """Render part labels for items and tile them onto pages: the library entry point to the label pipeline.
+
+    All sizes come from profile rather than module globals, so batches with different profiles (e.g. PRESETS) can
+    render at once in threads of one process, sharing its asset and thumbnail caches. Pages are composed lazily, one
+    per iteration, and only the labels of the current page are held.
+
+    Args:
+        items (list[Item]):
+        container: also yield "container" pages of thumbnails of every subcat in items
+        label_writer: if set, also save each distinct label to label_dir through it
+
+    Yields:
+        Page: "all_page<N>" pages, then any "container_page<N>" pages
+
+    """
+    unique, order = dedupe_items(items)
+    _preload_thumbs(unique, profile)
+    labels = map(functools.partial(_render_item, profile=profile), unique)
+    if label_writer:
+        labels = save_labels(labels, _item_label_names(unique), label_dir, label_writer)
+    labels = place_labels(labels, order)
+    yield from _grid_pages(labels, profile.papersize, profile.labelsize, "all", False, underlay, profile, compositor)
+    if container:
+        thumbs = _container_thumbs(items, profile)
+        size = profile.container_thumbsize
+        yield from _grid_pages(thumbs, profile.papersize, size, "container", False, underlay, profile, compositor)
+
+
+def _container_thumbs(items: list, profile: Profile = DEFAULT_PROFILE):
+    """Thumbnails of each distinct subcat image in items, sized to fit a container_thumbsize cell."""
+    container_subcats = sorted(set(_imname(i) for i in items))  # Sorted, so the page is the same on every run
+    size = profile.container_thumbsize
+    thumbsize = size[0] - profile.offset(10), size[1] - profile.offset(10)
+    return [THUMBS.get(SUBCAT_IMS, c, thumbsize, mode=profile.mode) for c in container_subcats]
+
+
+def render_pdf(
+    items: list, fout: str, container: bool = False, profile: Profile = DEFAULT_PROFILE, containers: str = None
+):
+    """Write part labels for items, and optionally a page of container thumbnails or container labels grouped by
+    CONTAINER_KEYS[containers], as one multi-page PDF.
+
+    """
+    profile = profile._replace(mode="RGBA")
+    pdf = PdfSheets(fout, profile)
+    pdf_tile(pdf, [pretty_item(i) for i in items], profile.papersize, profile.labelsize, pdf.draw_label)
+    if container:
+        container_ims = _container_thumbs(items, profile)
+        pdf_tile(pdf, container_ims, profile.papersize, profile.container_thumbsize, pdf.draw_image)
+    if containers:
+        groups = group_containers(items, containers)
+        pdf_tile(pdf, groups, profile.papersize, profile.container_labelsize, pdf.draw_container)
+    pdf.save()
+
+
+MANIFEST_NAME = "manifest.json"
+LABEL_FIELDS = ("category", "subcat", "gauge", "length")  # The Item fields _label_layout draws, see _label_key
+
+
+def _digest(*parts):
+    import hashlib
+
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def _label_key(item: Item, profile: Profile = DEFAULT_PROFILE):
+    """Hash of everything a part label's pixels depend on: the item's LABEL_FIELDS as printed, its image file and the
+    render profile. Items differing only in other fields (e.g. container, notes) share a label.
+
+    """
+    pretty = pretty_item(item)
+    return _digest([getattr(pretty, f) for f in LABEL_FIELDS], SUBCAT_IMS.digest(_imname(item)), list(profile))
+
+
+def _load_manifest(path: str):
+    if os.path.exists(path):
+        with open(path) as fin:
+            return json.load(fin)
+    return {"labels": {}, "pages": {}}
+
+
+def _incremental_tile(
+    entries,
+    target_size,
+    imsize,
+    out_label,
+    writer,
+    manifest,
+    old_manifest,
+    underlay=None,
+    profile=DEFAULT_PROFILE,
+    compositor="pillow",
+):
+    """Same layout as tile(), but only composite pages whose labels or output settings changed since old_manifest.
+
+    Args:
+        entries (list[(str, callable)]): per label, its key and a function that returns its image
+
+    Returns:
+        int: number of pages written
+
+    """
+    l_per_row, l_per_col = _tile_grid(target_size, imsize, profile.margin)
+    settings = [writer.fmt, writer.compress_level, underlay is not None, list(profile), list(target_size), list(imsize)]
+    written = 0
+    for pageno, page_entries in chunks(entries, int(l_per_col * l_per_row)):
+        fout = "{}_page{}.{}".format(out_label, pageno, writer.ext)
+        page_key = _digest([key for key, _ in page_entries], settings)
+        manifest["pages"][fout] = page_key
+        if old_manifest["pages"].get(fout) == page_key and os.path.exists(fout):
+            continue
+        placed = _grid_placements((load() for _, load in page_entries), target_size, imsize, profile=profile)
+        writer.save_page(placed, target_size, fout, underlay, profile, compositor)
+        written += 1
+    return written
+
+
+def incremental_build(
+    items: list,
+    writer: ImageWriter,
+    underlay=None,
+    container=False,
+    profile=DEFAULT_PROFILE,
+    outdir: str = OUTDIR,
+    compositor: str = "pillow",
+):
+    """Rebuild only what changed since the last incremental build.
+
+    A manifest in outdir maps each label's content hash (see _label_key) to its file, and each page to the hash of
+    its labels. Labels are re-rendered only if their hash is new, pages re-composited only if their label set
+    changed, and outputs that are no longer produced are deleted. Closes writer before saving the manifest.
+
+    """
+    manifest_path = os.path.join(outdir, MANIFEST_NAME)
+    old = _load_manifest(manifest_path)
+    new = {"labels": {}, "pages": {}}
+    keyed_items = {}
+    rendered = set()
+
+    def _label_path(key):
+        return os.path.join(outdir, new["labels"][key])
+
+    def _render(key):
+        rendered.add(key)
+        return make_label(pretty_item(keyed_items[key]), _label_path(key), profile=profile)
+
+    def _loader(key):
+        def load():
+            path = _label_path(key)
+            if (key in old["labels"] or key in rendered) and os.path.exists(path):
+                return Image.open(path)
+            return _render(key)
+
+        return load
+
+    entries = []
+    for item in items:
+        key = _label_key(item, profile)
+        if key not in keyed_items:
+            keyed_items[key] = item
+            new["labels"][key] = old["labels"].get(key) or "{} {} {}.png".format(item.subcat, item.category, key[:12])
+        entries.append((key, _loader(key)))
+    pages = _incremental_tile(
+        entries,
+        profile.papersize,
+        profile.labelsize,
+        "all",
+        writer,
+        new,
+        old,
+        underlay=underlay,
+        profile=profile,
+        compositor=compositor,
+    )
+    # Labels sitting on unchanged pages whose files went missing
+    for key in new["labels"]:
+        if key not in rendered and not os.path.exists(_label_path(key)):
+            _render(key)
+
+    if container:
+        size = profile.container_thumbsize
+        thumbsize = size[0] - profile.offset(10), size[1] - profile.offset(10)
+        entries = [
+            (
+                _digest(name, SUBCAT_IMS.digest(name), list(thumbsize), profile.mode),
+                functools.partial(THUMBS.get, SUBCAT_IMS, name, thumbsize, mode=profile.mode),
+            )
+            for name in sorted(set(_imname(i) for i in items))
+        ]
+        pages += _incremental_tile(
+            entries, profile.papersize, size, "container", writer, new, old, profile=profile, compositor=compositor
+        )
+
+    stale = [os.path.join(outdir, f) for f in set(old["labels"].values()) - set(new["labels"].values())]
+    stale += [f for f in old["pages"] if f not in new["pages"]]
+    for fout in stale:
+        if os.path.exists(fout):
+            os.remove(fout)
+    writer.close()
+    with open(manifest_path, "w") as fout:
+        json.dump(new, fout, indent=1, sort_keys=True)
+    print(
+        "Incremental build: {}/{} labels rendered, {}/{} pages written, {} stale files removed".format(
+            len(rendered), len(new["labels"]), pages, len(new["pages"]), len(stale)
+        )
+    )
+
+
+SIMPLE_IMS = {}  # Simple mode: map of fname to the AssetRegistry holding it
+
+
+def _init_worker(thumb_mem_mb: int = THUMB_MEM_MB, thumb_cache: str = None, simple_dirs=()):
+    """Configure this process's asset caches. Runs once in the parent and once per pool worker, so each worker
+    decodes and thumbnails its assets a single time.
+
+    """
+    THUMBS.max_bytes = thumb_mem_mb * 2 ** 20
+    THUMBS.cache_dir = thumb_cache
+    SIMPLE_IMS.clear()
+    for indir in simple_dirs:
+        registry = load_img_folder(indir)
+        SIMPLE_IMS.update(dict.fromkeys(registry, registry))
+
+
+def _render_item(item, profile: Profile = DEFAULT_PROFILE):
+    """Render an item that has already been through pretty_item."""
+    return make_label(item, None, profile=profile)
+
+
+def _item_label_names(items: list):
+    """File names, without extension, for the distinct labels of items as from dedupe_items."""
+    return ["{} {} {}".format(item.subcat, item.category, i) for i, item in enumerate(items)]
+
+
+def label_backlog_for(labelsize, mode: str, stream: bool = False):
+    """Labels to queue for --labels-out writes: LABEL_BACKLOG, or when streaming as many labels of labelsize in mode
+    as fit in LABEL_BACKLOG_STREAM_MB (at least 1), so the queue doesn't outgrow the page --stream bounds memory to.
+
+    """
+    if not stream:
+        return LABEL_BACKLOG
+    label_bytes = labelsize[0] * labelsize[1] * (4 if mode == "RGBA" else 1)
+    return max(1, min(LABEL_BACKLOG, LABEL_BACKLOG_STREAM_MB * 2 ** 20 // label_bytes))
+
+
+def save_labels(labels, names, outdir: str, writer: ImageWriter):
+    """Hand each label to writer to save in the background as `<outdir>/<name>.<ext>`, and yield it on.
+
+    Rendering only waits on the disk when writer's backlog (its max_pending) is full.
+
+    """
+    os.makedirs(outdir, exist_ok=True)
+    for label, name in zip(labels, names):
+        writer.save(label, os.path.join(outdir, "{}.{}".format(name, writer.ext)))
+        yield label
+
+
+def _render_container(container: Container, profile: Profile = DEFAULT_PROFILE):
+    return make_container_label(container.items, None, profile=profile, name=container.name)
+
+
+def _render_simple(fname: str, profile: Profile = DEFAULT_PROFILE, registry: AssetRegistry = None):
+    registry = registry or SIMPLE_IMS[fname]
+    return make_simple_square(
+        None,
+        fname,
+        thumbsize=profile.simple_thumbsize,
+        labelsize=profile.simple_labelsize,
+        font=profile.font_sub,
+        profile=profile,
+        thumb=THUMBS.get_simple(registry, fname, profile.simple_thumbsize),
+    )
+
+
+def render_all(fn, args, jobs: int = 1, initargs=()):
+    """Lazily yield fn(arg) for each arg, in order.
+
+    If jobs > 1, spread the calls over a pool of `jobs` processes, each set up by _init_worker(*initargs). At most
+    2 * jobs results are in flight at once, so a slow consumer (e.g. tile() streaming pages) bounds memory use.
+
+    """
+    if jobs > 1:
+        import multiprocessing  # Only needed with --jobs, and slow to import
+
+        with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=initargs) as pool:
+            pending = deque()
+            for arg in args:
+                pending.append(pool.apply_async(fn, (arg,)))
+                if len(pending) >= 2 * jobs:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+    else:
+        yield from map(fn, args)
+
+
+def _hit_rate(hits: int, misses: int):
+    return {"hits": hits, "misses": misses, "hit_rate": hits / (hits + misses) if hits + misses else None}
+
+
+def _peak_rss_mb(who: str):
+    """Peak RSS of this process ("self") or its finished children ("children"), or None where unknown."""
+    try:
+        import resource  # POSIX only, and only needed here, so it doesn't slow down or break importing label
+    except ImportError:
+        return None
+    return resource.getrusage(getattr(resource, "RUSAGE_" + who.upper())).ru_maxrss / 1024
+
+
+def profile_report(wall: float):
+    """Everything --profile reports: per stage timings, peak memory and cache hit rates, as a JSON-able dict."""
+    text = [f.cache_info() for f in (_text_size, _text_mask, to_unifrac)]
+    return {
+        "wall": wall,
+        "stages": TIMINGS.report(),
+        "peak_rss_mb": _peak_rss_mb("self"),
+        "peak_rss_workers_mb": _peak_rss_mb("children"),
+        "caches": {
+            "thumbnail": _hit_rate(THUMBS.hits + THUMBS.disk_hits, THUMBS.misses),
+            "text": _hit_rate(sum(i.hits for i in text), sum(i.misses for i in text)),
+        },
+    }
+
+
+def format_profile(report: dict):
+    """Human-readable version of a profile_report."""
+    row = "{:<10} {:>7} {:>6} {:>9} {:>9} {:>9}"
+    lines = [row.format("stage", "count", "per", "total s", "p50 ms", "p95 ms")]
+    for name, s in report["stages"].items():
+        lines.append(
+            row.format(
+                name,
+                s["count"],
+                s["per"],
+                "{:.2f}".format(s["total"]),
+                "{:.1f}".format(s["p50"] * 1000),
+                "{:.1f}".format(s["p95"] * 1000),
+            )
+        )
+    if report["peak_rss_mb"] is None:
+        lines.append("Wall time {:.2f}s".format(report["wall"]))
+    else:
+        lines.append(
+            "Wall time {:.2f}s, peak RSS {:.0f} MB (workers {:.0f} MB)".format(
+                report["wall"], report["peak_rss_mb"], report["peak_rss_workers_mb"]
+            )
+        )
+    for name, c in report["caches"].items():
+        rate = "-" if c["hit_rate"] is None else "{:.0%}".format(c["hit_rate"])
+        lines.append(
+            "{} cache: {} hit rate ({} hits, {} misses)".format(name.capitalize(), rate, c["hits"], c["misses"])
+        )
+    return "\n".join(lines)
+
+
+def _start_profile(jobs: int, json_path: str, cprofile_path: str = None):
+    """Enable stage timing (and cProfile) for the rest of the command, reporting when it exits."""
+    TIMINGS.enabled = True
+    start = time.perf_counter()
+    profiler = None
+    if cprofile_path:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    def finish():
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(cprofile_path)
+            print("Wrote cProfile stats to {}".format(cprofile_path))
+        report = profile_report(time.perf_counter() - start)
+        print(format_profile(report))
+        if jobs > 1:
+            print("Label, decode, thumbnail and text stages ran in worker processes and are not included")
+        with open(json_path, "w") as fout:
+            json.dump(report, fout, indent=1)
+        print("Wrote profile to {}".format(json_path))
+
+    click.get_current_context().call_on_close(finish)
 
 
 @click.command()
 @click.option("-s", "--simple", is_flag=True, default=False)
 @click.option("-t", "--template", is_flag=True, default=False)
 @click.option("-k", "--skip-cells", type=int, default=0)
-@click.option("-f", "--outfile", default="out.png")
+@click.option("-f", "--outfile", default="out.png", help="Simple mode output; the extension follows --page-format")
+@click.option("--stream", is_flag=True, default=False, help="Render and save one page at a time to bound memory")
+@click.option(
+    "--page-format", type=click.Choice(list(PAGE_FORMATS) + ["pdf"]), default="png", help="Output format for pages"
+)
+@click.option(
+    "--bands",
+    is_flag=True,
+    default=False,
+    help="Compose and encode pages {} rows at a time; implies --stream".format(BAND_ROWS),
+)
+@click.option("--compress-level", type=click.IntRange(0, 9), default=None, help="PNG compression level (0-9)")
+@click.option("--labels-out", default=None, help="Also save each distinct label to this folder, e.g. {}".format(OUTDIR))
+@click.option("--label-format", type=click.Choice(list(PAGE_FORMATS)), default="png", help="Format for --labels-out")
+@click.option(
+    "--label-compress-level", type=click.IntRange(0, 9), default=None, help="PNG compression level for --labels-out"
+)
+@click.option(
+    "--label-backlog",
+    type=int,
+    default=None,
+    help="Labels queued for --labels-out before rendering waits [default: {}, or {} MB of labels with --stream]".format(
+        LABEL_BACKLOG, LABEL_BACKLOG_STREAM_MB
+    ),
+)
+@click.option("--proof", is_flag=True, default=False, help="Fast, low-compression PNGs for proofing")
+@click.option(
+    "--color-mode", type=click.Choice(list(COLOR_MODES)), default="rgba", help="Render in RGBA, grayscale, 1-bit or palette"
+)
+@click.option("--draft", is_flag=True, default=False, help="Fast preview at {} DPI with the same layout".format(DRAFT_DPI))
+@click.option(
+    "--compositor", type=click.Choice(COMPOSITORS), default="pillow", help="Build pages with Pillow or NumPy"
+)
+@click.option(
+    "--pack", is_flag=True, default=False, help="Pack labels of mixed sizes onto as few pages as possible, not a grid"
+)
+@click.option(
+    "--containers",
+    type=click.Choice(list(CONTAINER_KEYS)),
+    default=None,
+    help="Also make a label for each container, grouping items by a container column, gauge diameter, etc.",
+)
+@click.option("-i", "--incremental", is_flag=True, default=False, help="Only re-render labels and pages that changed")
+@click.option("-j", "--jobs", type=int, default=1, help="Number of processes to render labels with")
+@click.option("--thumb-mem-mb", type=int, default=THUMB_MEM_MB, help="Max MB of thumbnails kept in memory")
+@click.option("--thumb-cache", default=None, help="Directory to persist thumbnails in between runs")
+@click.option("--profile", "profile_run", is_flag=True, default=False, help="Report time per stage, memory and caches")
+@click.option("--profile-json", default="profile.json", help="Where --profile writes its JSON report")
+@click.option("--cprofile", default=None, help="With --profile, also dump cProfile stats to this file")
 @click.argument("inpath", required=True)
-def main(simple, template, skip_cells, outfile, inpath):
-    labels = []
-    if not simple:
-        items = load_items(inpath[0])
-        print("Loaded {} items".format(len(items)))
-
-        for i, item in enumerate(items):
-            fname = "{} {} {}.png".format(item.subcat, item.category, str(i))
-            label = make_label(pretty_item(item), os.path.join(OUTDIR, fname))
-            labels.append(label)
-
-    else:
-        # Simple mode: just load a dir of images, use name as text
-        simple_ims = {}
-        print(inpath)
-        for indir in [inpath]: # minor change to support nargs=-1 on inpath
-            simple_ims.update(load_img_folder(indir))
-        for fname, im in simple_ims.items():
-            labels.append(make_simple_square(im, fname, thumbsize=SIMPLE_THUMBSIZE, labelsize=SIMPLE_LABELSIZE, font=FONT_SUB))
+def main(
+    simple,
+    template,
+    skip_cells,
+    outfile,
+    stream,
+    page_format,
+    bands,
+    compress_level,
+    labels_out,
+    label_format,
+    label_compress_level,
+    label_backlog,
+    proof,
+    color_mode,
+    draft,
+    compositor,
+    pack,
+    containers,
+    incremental,
+    jobs,
+    thumb_mem_mb,
+    thumb_cache,
+    profile_run,
+    profile_json,
+    cprofile,
+    inpath,
+):
+    if profile_run:
+        _start_profile(jobs, profile_json, cprofile)
+    if compositor == "numpy" and not _import_numpy():
+        raise click.UsageError("--compositor numpy needs NumPy installed")
+    # Simple mode: just load a dir of images, use name as text
+    simple_dirs = [inpath] if simple else []  # minor change to support nargs=-1 on inpath
+    initargs = (thumb_mem_mb, thumb_cache, simple_dirs)
+    profile = Profile(mode=COLOR_MODES[color_mode])
+    if draft:
+        profile = profile.draft()
+    _init_worker(*initargs)
+    stream = stream or bands  # Else every label is held anyway, which is as much memory as the page bands save
+    if bands and (page_format not in BAND_ENCODERS or compositor != "pillow"):
+        raise click.UsageError("--bands writes {} pages with the pillow compositor".format(" or ".join(BAND_ENCODERS)))
+    if pack and (template or incremental or page_format == "pdf"):
+        raise click.UsageError("--pack can't be combined with --template, --incremental or PDF output")
+    if labels_out and (incremental or page_format == "pdf"):
+        raise click.UsageError("--labels-out doesn't apply to PDF or --incremental, which keeps labels in " + OUTDIR)
+    if containers and (simple or incremental):
+        raise click.UsageError("--containers is only supported for part labels, without --incremental")
+    if page_format == "pdf":
+        if simple:
+            raise click.UsageError("PDF output is only supported for part labels")
+        render_pdf(
+            load_items(inpath),
+            "all.pdf",
+            container=inpath.endswith(INVENTORY_EXTS) and not containers,
+            profile=profile,
+            containers=containers,
+        )
+        return
 
     underlay = Image.open("label_sheet_template.png").convert("RGBA") if template else None
 
+    if proof and compress_level is None:
+        compress_level = PROOF_COMPRESS_LEVEL
+    # Streaming bounds memory to the page being composed plus one being written, so only one write may be pending
+    writer = ImageWriter(
+        page_format,
+        compress_level=compress_level,
+        workers=1 if stream else 2,
+        max_pending=1 if stream else 2,
+        band_rows=BAND_ROWS if bands else None,
+    )
+    label_writer = None
+    if labels_out:
+        if label_backlog is None:
+            labelsize = profile.simple_labelsize if simple else profile.labelsize
+            label_backlog = label_backlog_for(labelsize, profile.mode, stream)
+        label_writer = ImageWriter(
+            label_format,
+            compress_level=label_compress_level,
+            max_pending=label_backlog,
+            name="labels",
+            verbose=False,
+            stage="encode_label",
+        )
+
+    if incremental:
+        if simple:
+            raise click.UsageError("Incremental builds are only supported for part labels")
+        incremental_build(
+            load_items(inpath),
+            writer,
+            underlay,
+            container=inpath.endswith(INVENTORY_EXTS),
+            profile=profile,
+            compositor=compositor,
+        )
+        return
     if not simple:
-        tile(labels, PAPERSIZE, LABELSIZE, "all", underlay=underlay)
+        items = load_items(inpath)
+        unique, order = dedupe_items(items)
+        print("Loaded {} items, {} unique labels".format(len(items), len(unique)))
+        if jobs <= 1:  # Pool workers have caches of their own
+            _preload_thumbs(unique, profile)
+        labels = render_all(functools.partial(_render_item, profile=profile), unique, jobs, initargs)
+        if label_writer:
+            labels = save_labels(labels, _item_label_names(unique), labels_out, label_writer)
+        labels = place_labels(labels, order)
+        if not stream or pack:  # Packing needs every label's size up front
+            labels = list(labels)
     else:
-        im = template_tile(labels, cell_size=CELLSIZE, cell_margin=CELL_MARGIN, underlay=underlay, skip_cells=skip_cells)
-        im.save(outfile)
+        print(inpath)
+        if jobs <= 1:
+            thumbsize = profile.simple_thumbsize
+            preload_assets(lambda fname: THUMBS.get_simple(SIMPLE_IMS[fname], fname, thumbsize), SIMPLE_IMS)
+        labels = render_all(functools.partial(_render_simple, profile=profile), list(SIMPLE_IMS), jobs, initargs)
+        if label_writer:
+            labels = save_labels(labels, list(SIMPLE_IMS), labels_out, label_writer)
+        labels = list(labels)
+
+    # Container labels replace the page of container thumbnails a single inventory file otherwise gets
+    container = inpath.endswith(INVENTORY_EXTS) and not containers
+    container_labels = None
+    if containers:
+        groups = group_containers(items, containers)
+        print("{} containers by {}".format(len(groups), containers))
+        render = functools.partial(_render_container, profile=profile)
+        container_labels = render_all(render, groups, jobs, initargs) if groups else None
+    if pack:
+        if container:  # Fill the gaps between part labels with the container thumbnails
+            labels += _container_thumbs(items, profile)
+            container = False
+        if container_labels:
+            labels += list(container_labels)
+            container_labels = None
+        out_label = os.path.splitext(outfile)[0] if simple else "all"
+        pack_tile(labels, profile.papersize, out_label, writer=writer, profile=profile, compositor=compositor)
+    elif not simple:
+        tile(
+            labels,
+            profile.papersize,
+            profile.labelsize,
+            "all",
+            underlay=underlay,
+            writer=writer,
+            profile=profile,
+            compositor=compositor,
+        )
+    else:
+        im = template_tile(
+            labels,
+            cell_size=profile.cellsize,
+            underlay=underlay,
+            skip_cells=skip_cells,
+            profile=profile,
+            compositor=compositor,
+        )
+        writer.save(im, "{}.{}".format(os.path.splitext(outfile)[0], writer.ext))
+
+    if container_labels:
+        tile(
+            container_labels,
+            profile.papersize,
+            profile.container_labelsize,
+            "containers",
+            writer=writer,
+            profile=profile,
+            compositor=compositor,
+        )
 
     ### If we're labeling a single CSV, assume it's for one container and generate a container label too
-    if inpath[0].endswith("csv"):
-        container_subcats = set(_imname(i) for i in items)
-        container_ims = [SUBCAT_IMS[c] for c in container_subcats]
-        tile(container_ims, PAPERSIZE, CONTAINER_THUMBSIZE, "container", rethumb=True)
+    if container:
+        container_ims = _container_thumbs(items, profile)
+        tile(
+            container_ims,
+            profile.papersize,
+            profile.container_thumbsize,
+            "container",
+            writer=writer,
+            profile=profile,
+            compositor=compositor,
+        )
+    writer.close()
+    if label_writer:
+        label_writer.close()
+
+    if jobs == 1:  # Workers keep their own counts
+        if not simple:
+            print(THUMBS.summary())
+        print(text_cache_summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,381 @@
+"""Label rendering daemon for on-demand printing, e.g. from a kiosk.
+
+Keeps one process running so fonts, thumbnails and text caches stay warm between jobs, instead of paying for them
+on every `python label.py`. Jobs are JSON posted over HTTP, on localhost or a Unix socket:
+
+    python labeld.py                          # http://127.0.0.1:8765
+    python labeld.py --socket /tmp/labeld.sock
+
+    curl -d @job.json http://127.0.0.1:8765/render -o labels.zip
+    curl --unix-socket /tmp/labeld.sock -d @job.json http://localhost/render -o labels.zip
+    curl http://127.0.0.1:8765/metrics
+
+A job renders either item rows, like a CSV's, or a folder of images in simple mode:
+
+    {"items": [{"category": "screw", "subcat": "wood", "gauge": "#8", "length": "1\\"", "qty": 2}], "container": true}
+    {"simple": "simple_ims/drawer1", "template": true, "skip_cells": 3}
+
+Both take "format" (png, tiff, bmp, or pdf for items), "color_mode", "draft", "template" and "compositor", like the
+label.py options of the same names, and "preset", one of label.PRESETS. A simple job's folder must be under
+--simple-root (simple_ims by default). Page images come back as a zip, PDFs as is. A job may have up to
+MAX_JOB_ROWS rows of qty up to MAX_JOB_QTY, making up to MAX_JOB_PAGES pages. At most --workers jobs render at once;
+up to --max-queue more wait their turn, and beyond that requests are turned away with 503.
+
+Run from the repo root, like label.py.
+"""
+import asyncio
+import click
+import functools
+import io
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from PIL import Image
+
+import label
+
+MAX_BODY_MB = 16  # Largest job accepted
+MAX_JOB_ROWS = 1000  # Item rows accepted in one job
+MAX_JOB_QTY = 100  # Largest qty of a single row
+MAX_JOB_PAGES = 20  # Pages of part labels one job may render, so a single request can't hold up the others for long
+LATENCY_WINDOW = 1000  # Recent requests the latency percentiles in /metrics cover
+TEMPLATE_PATH = "label_sheet_template.png"
+SIMPLE_ROOT = "simple_ims"  # Simple mode jobs may only name image folders under this one; set with --simple-root
+FORMATS = list(label.PAGE_FORMATS) + ["pdf"]
+
+
+class JobError(ValueError):
+    """A job that can't be rendered as given, reported to the client as 400 Bad Request."""
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+@functools.lru_cache(maxsize=None)
+def _template():
+    return Image.open(TEMPLATE_PATH).convert("RGBA")
+
+
+_simple_lock = threading.Lock()
+_simple_registries = {}  # Simple mode: image folder -> its AssetRegistry, kept warm between jobs
+
+
+def _simple_registry(path: str):
+    """The AssetRegistry of a simple mode job's image folder, which must be under SIMPLE_ROOT and hold images."""
+    key = os.path.realpath(path)
+    root = os.path.realpath(SIMPLE_ROOT)
+    if os.path.commonpath([key, root]) != root or not os.path.isdir(key):
+        raise JobError("No image folder {} under {}".format(path, SIMPLE_ROOT))
+    with _simple_lock:
+        if key not in _simple_registries:
+            _simple_registries[key] = label.load_img_folder(key)
+        registry = _simple_registries[key]
+    if not len(registry):
+        raise JobError("No images in {}".format(path))
+    return registry
+
+
+def _job_items(rows: list):
+    """Items for a job's rows, which have the same fields as a CSV row. Raises JobError on the first bad row."""
+    if not isinstance(rows, list) or not rows:
+        raise JobError('"items" must be a non-empty list of rows')
+    if len(rows) > MAX_JOB_ROWS:
+        raise JobError("A job may have at most {} rows, not {}".format(MAX_JOB_ROWS, len(rows)))
+    items = []
+    for i, row in enumerate(rows):
+        # JSON values may be numbers, e.g. "qty": 2, so stringify them like JSON Lines inventory rows
+        fields = label._json_row(json.dumps(row)) if isinstance(row, dict) else {}
+        qty = fields.get("qty") or "1"
+        if qty.strip().isdigit() and int(qty) > MAX_JOB_QTY:  # Checked first, as _row_items makes qty copies
+            raise JobError("Row {} has qty {}, over the limit of {}".format(i, qty, MAX_JOB_QTY))
+        row_items = label._row_items(fields) if fields else None
+        if row_items is None:
+            raise JobError("Row {} needs a category, subcat and gauge, and a whole number qty: {}".format(i, row))
+        items.extend(row_items)
+    return items
+
+
+def _job_choice(job: dict, key: str, default: str, choices):
+    """job[key], which must be one of choices. Checked as a string first, as JSON lists and objects can't be hashed."""
+    value = job.get(key, default)
+    if not isinstance(value, str) or value not in choices:
+        raise JobError("Unknown {} {}, expected one of {}".format(key, json.dumps(value), ", ".join(choices)))
+    return value
+
+
+def _page_order(fname: str):
+    return [int(t) if t.isdigit() else t for t in re.split(r"(\d+)", fname)]
+
+
+def _zip_dir(path: str):
+    """The files in path as a zip, pages in page order. They're already compressed images, so they are stored."""
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for fname in sorted(os.listdir(path), key=_page_order):
+            zf.write(os.path.join(path, fname), fname)
+    return buf.getvalue()
+
+
+def render_job(job: dict):
+    """Render one job with the warm caches of this process.
+
+    Returns:
+        (str, str, bytes): content type, file name and contents of the response
+
+    """
+    if not isinstance(job, dict) or ("items" in job) == ("simple" in job):
+        raise JobError('A job needs exactly one of "items" or "simple"')
+    fmt = _job_choice(job, "format", "png", FORMATS)
+    color_mode = _job_choice(job, "color_mode", "rgba", label.COLOR_MODES)
+    compositor = _job_choice(job, "compositor", "pillow", label.COMPOSITORS)
+    profile = label.PRESETS[_job_choice(job, "preset", "default", label.PRESETS)]
+    profile = profile._replace(mode=label.COLOR_MODES[color_mode])
+    skip_cells = job.get("skip_cells", 0)
+    if not isinstance(skip_cells, int) or isinstance(skip_cells, bool) or skip_cells < 0:
+        raise JobError('"skip_cells" must be a whole number, not {}'.format(json.dumps(skip_cells)))
+    if job.get("draft"):
+        profile = profile.draft()
+    underlay = _template() if job.get("template") else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if "simple" in job:
+            if fmt == "pdf":
+                raise JobError("PDF output is only supported for part labels")
+            registry = _simple_registry(job["simple"])
+            labels = [label._render_simple(fname, profile, registry) for fname in registry]
+            writer = label.ImageWriter(fmt)
+            im = label.template_tile(
+                labels,
+                cell_size=profile.cellsize,
+                underlay=underlay,
+                skip_cells=skip_cells,
+                profile=profile,
+                compositor=compositor,
+            )
+            writer.save(im, os.path.join(tmp, "simple.{}".format(writer.ext)))
+            writer.close()
+            return "application/zip", "labels.zip", _zip_dir(tmp)
+
+        items = _job_items(job["items"])
+        l_per_row, l_per_col = label._tile_grid(profile.papersize, profile.labelsize, profile.margin)
+        n_pages = math.ceil(len(items) / (l_per_row * l_per_col))
+        if n_pages > MAX_JOB_PAGES:
+            raise JobError("{} labels make {} pages, over the limit of {}".format(len(items), n_pages, MAX_JOB_PAGES))
+        if fmt == "pdf":
+            fout = os.path.join(tmp, "all.pdf")
+            label.render_pdf(items, fout, container=bool(job.get("container")), profile=profile)
+            with open(fout, "rb") as fin:
+                return "application/pdf", "labels.pdf", fin.read()
+        writer = label.ImageWriter(fmt)
+        pages = label.render_batch(
+            items, profile, container=bool(job.get("container")), underlay=underlay, compositor=compositor
+        )
+        for page in pages:
+            writer.save(page.image, os.path.join(tmp, "{}.{}".format(page.name, writer.ext)))
+        writer.close()
+        return "application/zip", "labels.zip", _zip_dir(tmp)
+
+
+def _percentiles(samples):
+    s = sorted(samples)
+    if not s:
+        return {"count": 0, "p50": None, "p95": None, "max": None}
+    return {
+        "count": len(s),
+        "p50": s[max(0, math.ceil(0.50 * len(s)) - 1)],
+        "p95": s[max(0, math.ceil(0.95 * len(s)) - 1)],
+        "max": s[-1],
+    }
+
+
+class LabelDaemon:
+    """Serves render jobs, running at most `workers` at once on a thread pool and queueing up to `max_queue` more."""
+
+    def __init__(self, workers: int = 1, max_queue: int = 16):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.started = time.time()
+        self.waiting = 0
+        self.running = 0
+        self.counts = {"requests": 0, "rendered": 0, "errors": 0, "rejected": 0}
+        self.latency = deque(maxlen=LATENCY_WINDOW)
+        self.queue_wait = deque(maxlen=LATENCY_WINDOW)
+        self._slots = asyncio.Semaphore(workers)
+        self._pool = ThreadPoolExecutor(workers, thread_name_prefix="render")
+
+    async def render(self, job: dict):
+        if self.waiting >= self.max_queue:
+            self.counts["rejected"] += 1
+            raise HttpError(503, "{} jobs already queued, try again later".format(self.waiting))
+        queued = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.queue_wait.append(time.perf_counter() - queued)
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, render_job, job)
+        finally:
+            self.running -= 1
+            self._slots.release()
+
+    def metrics(self):
+        report = label.profile_report(time.time() - self.started)
+        return {
+            "uptime": report["wall"],
+            **self.counts,
+            "queue_depth": self.waiting,
+            "running": self.running,
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "latency": _percentiles(self.latency),
+            "queue_wait": _percentiles(self.queue_wait),
+            "peak_rss_mb": report["peak_rss_mb"],
+            "caches": report["caches"],
+        }
+
+    async def route(self, method: str, path: str, body: bytes):
+        """Returns (status, content type, file name or None, body) for one request."""
+        if path == "/metrics":
+            if method != "GET":
+                raise HttpError(405, "Use GET /metrics")
+            return 200, "application/json", None, json.dumps(self.metrics(), indent=1).encode()
+        if path == "/render":
+            if method != "POST":
+                raise HttpError(405, "POST a job to /render")
+            try:
+                job = json.loads(body)
+            except ValueError as e:
+                raise HttpError(400, "Job isn't valid JSON: {}".format(e))
+            try:
+                content_type, fname, out = await self.render(job)
+            except JobError as e:
+                raise HttpError(400, str(e))
+            self.counts["rendered"] += 1
+            return 200, content_type, fname, out
+        raise HttpError(404, "Unknown path {}, expected /render or /metrics".format(path))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve one HTTP/1.1 request per connection."""
+        start = time.perf_counter()
+        self.counts["requests"] += 1
+        method = path = "-"
+        try:
+            method, path, headers = await _read_head(reader)
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_MB * 2 ** 20:
+                raise HttpError(413, "Jobs are limited to {} MB".format(MAX_BODY_MB))
+            body = await reader.readexactly(length)
+            status, content_type, fname, out = await self.route(method, path, body)
+        except HttpError as e:
+            status, content_type, fname, out = e.status, "text/plain", None, (str(e) + "\n").encode()
+        except (ValueError, asyncio.IncompleteReadError) as e:
+            status, content_type, fname, out = 400, "text/plain", None, "Bad request: {}\n".format(e).encode()
+        except Exception as e:
+            status, content_type, fname, out = 500, "text/plain", None, "{}: {}\n".format(type(e).__name__, e).encode()
+        if status >= 400:
+            self.counts["errors"] += 1
+        head = [
+            "HTTP/1.1 {} {}".format(status, HTTPStatus(status).phrase),
+            "Content-Type: {}".format(content_type),
+            "Content-Length: {}".format(len(out)),
+            "Connection: close",
+        ]
+        if fname:
+            head.append('Content-Disposition: attachment; filename="{}"'.format(fname))
+        try:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + out)
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+        except ConnectionError:
+            pass  # Client went away
+        elapsed = time.perf_counter() - start
+        if path == "/render":
+            self.latency.append(elapsed)
+        print("{} {} {} {:.2f}s, {} queued".format(method, path, status, elapsed, self.waiting))
+
+
+async def _read_head(reader: asyncio.StreamReader):
+    """Parse a request line and headers. Returns (method, path, headers with lowercase names)."""
+    method, path, _ = (await reader.readline()).decode("latin-1").split(" ", 2)
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1")
+        if line in ("\r\n", "\n", ""):
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return method, path.split("?")[0], headers
+
+
+def _preload():
+    """Build the default profile's thumbnails of every asset, as label._preload_thumbs does for a run's items, and
+    load its fonts now rather than on the first job.
+
+    """
+    profile = label.DEFAULT_PROFILE
+    cell = profile.container_thumbsize
+    sizes = [
+        (label.SUBCAT_IMS, profile.thumbsize),  # Part labels
+        (label.SUBCAT_IMS, (cell[0] - profile.offset(10), cell[1] - profile.offset(10))),  # Container pages
+        (label.CAT_IMS, profile.container_thumbsize),  # Container labels
+    ]
+    for registry, size in sizes:
+        thumb = functools.partial(label.THUMBS.get, registry, size=size, mode=profile.mode)
+        label.preload_assets(thumb, registry)
+    profile.font_head, profile.font_sub
+
+
+async def serve(daemon: LabelDaemon, socket_path: str = None, host: str = "127.0.0.1", port: int = 8765):
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)  # Left behind by a previous run
+        server = await asyncio.start_unix_server(daemon.handle, path=socket_path)
+        where = socket_path
+    else:
+        server = await asyncio.start_server(daemon.handle, host, port)
+        where = "http://{}:{}".format(host, port)
+    print("Serving on {} with {} workers".format(where, daemon.workers))
+    async with server:
+        await server.serve_forever()
+
+
+@click.command()
+@click.option("--socket", "socket_path", default=None, help="Serve on this Unix socket instead of TCP")
+@click.option("--host", default="127.0.0.1", help="Address to serve HTTP on")
+@click.option("--port", type=int, default=8765, help="Port to serve HTTP on")
+@click.option("-w", "--workers", type=int, default=1, help="Jobs rendered at once")
+@click.option("--max-queue", type=int, default=16, help="Jobs waiting for a worker before new ones are refused")
+@click.option("--thumb-mem-mb", type=int, default=label.THUMB_MEM_MB, help="Max MB of thumbnails kept in memory")
+@click.option("--thumb-cache", default=None, help="Directory to persist thumbnails in between runs")
+@click.option("--simple-root", default=SIMPLE_ROOT, show_default=True, help="Folder simple mode jobs may read from")
+@click.option("--preload", is_flag=True, default=False, help="Build thumbnails and load fonts before serving")
+def main(socket_path, host, port, workers, max_queue, thumb_mem_mb, thumb_cache, simple_root, preload):
+    global SIMPLE_ROOT
+    SIMPLE_ROOT = simple_root
+    label._init_worker(thumb_mem_mb, thumb_cache)
+    if preload:
+        _preload()
+    try:
+        asyncio.run(serve(LabelDaemon(workers, max_queue), socket_path, host, port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()